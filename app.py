@@ -1,14 +1,35 @@
-from flask import Flask, render_template, send_from_directory, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, send_from_directory, request, redirect, url_for, session, jsonify, abort
 from werkzeug.utils import secure_filename
 import os
-import json
 import glob
+import shutil
 import socket
 import re
 from datetime import datetime
+from bisect import bisect_right
+from itertools import islice
+from content_store import ContentStore, thaw
+from json_files import JsonDocument, newest_mtime
+from http_cache import CachedPage, PageCache, compress_response, conditional
+from content_db import db_signature
+from content_index import SORT_ORDERS, decode_cursor, encode_cursor
+from search_index import SearchIndex, SuggestIndex
+from upload_store import find_upload, save_upload, store_file, upload_digest, upload_label
+from chunked_uploads import ChunkConflict, ChunkedUploads
+from file_serving import GZIP_DIR, IMMUTABLE, REVALIDATE, send_stored_file
+from thumbnails import DERIVATIVE_SIZES, derivative_path, image_srcset, responsive_images, schedule_derivatives, thumbnail_path
 
 app = Flask(__name__)
 app.secret_key = 'change-this-secret'
+# Optionally let a fronting web server send upload and resource files:
+# 'x-accel' (nginx) or 'x-sendfile' (Apache mod_xsendfile, lighttpd)
+app.config['FILE_OFFLOAD'] = os.environ.get('TRUCKSOFT_FILE_OFFLOAD', '')
+# For x-accel, files under FILE_OFFLOAD_ROOT (the app folder, which holds the
+# resource files and uploads/) are redirected to ACCEL_REDIRECT_PREFIX plus
+# their relative path; nginx needs the matching internal location:
+#     location /protected-files/ { internal; alias /path/to/site/; }
+app.config['FILE_OFFLOAD_ROOT'] = os.environ.get('TRUCKSOFT_FILE_OFFLOAD_ROOT', app.root_path)
+app.config['ACCEL_REDIRECT_PREFIX'] = os.environ.get('TRUCKSOFT_ACCEL_PREFIX', '/protected-files/')
 
 # Global client service queue (in production, use Redis or database)
 CLIENT_SERVICE_QUEUE = {}
@@ -28,15 +49,127 @@ except Exception as e:
 
 RESOURCE_EXTENSIONS = {'.pdf', '.zip', '.rar', '.7z'}
 POSTS_PATH = os.path.join(app.root_path, 'posts.json')
+POSTS_DIR = os.path.join(app.root_path, 'posts')
 CATEGORIES_PATH = os.path.join(app.root_path, 'categories.json')
 ADMIN_PASSWORD = os.environ.get('TRUCKSOFT_ADMIN_PASSWORD', 'secret')
 UPLOAD_FOLDER = os.path.join(app.root_path, 'uploads')
 CHATS_PATH = os.path.join(app.root_path, 'chat.json')
 ADMINS_PATH = os.path.join(app.root_path, 'admins.json')
 EXTERNAL_TOOLS_CONFIG_PATH = os.path.join(app.root_path, 'external_tools_config.json')
+RESOURCES_PATH = os.path.join(app.root_path, 'resources.json')
+DATABASE_PATH = os.path.join(app.root_path, 'database.db')
 ALLOWED_ATTACH_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff', 'svg', 'txt', 'doc', 'docx', 'zip', 'rar', '7z'}
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff', 'svg'}
+
+# Largest file accepted through the resumable chunked upload (attachments and resource archives)
+MAX_CHUNKED_UPLOAD_SIZE = int(os.environ.get('TRUCKSOFT_MAX_UPLOAD_MB', '4096')) * 1024 * 1024
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Kept inside the upload folder so finished files are moved into place, not copied
+chunked_uploads = ChunkedUploads(os.path.join(UPLOAD_FOLDER, 'partial'), MAX_CHUNKED_UPLOAD_SIZE)
+# Uploaded images in posts get srcsets pointing at their downscaled copies
+app.add_template_filter(lambda content: responsive_images(UPLOAD_FOLDER, content), 'responsive_images')
+app.add_template_global(lambda src: image_srcset(UPLOAD_FOLDER, src), 'image_srcset')
+app.add_template_global(DERIVATIVE_SIZES, 'image_sizes')
+app.add_template_filter(upload_label)
+
+# Where posts, categories and resources live: 'json' (the posts/ directory and
+# JSON files) or 'sqlite' (tables in database.db; import them once with python content_db.py)
+CONTENT_BACKEND = os.environ.get('TRUCKSOFT_CONTENT_BACKEND', 'json')
+
+# Parsed posts, categories and resources shared by all requests
+if CONTENT_BACKEND == 'sqlite':
+    from content_db import SqliteContentStore
+    content_store = SqliteContentStore(DATABASE_PATH)
+else:
+    content_store = ContentStore(POSTS_DIR, CATEGORIES_PATH, RESOURCES_PATH, legacy_posts_path=POSTS_PATH)
+
+
+def default_external_tools_config():
+    return {
+        "server_tools": [],
+        "settings": {
+            "allow_custom_tools": True,
+            "allow_user_tools": True,
+            "require_admin_approval": False,
+            "log_tool_usage": True,
+            "max_user_tools": 10
+        }
+    }
+
+
+def normalize_external_tools_config(config):
+    # Handle legacy format
+    if "tools" in config and "server_tools" not in config:
+        config["server_tools"] = config.pop("tools", [])
+    
+    # Ensure server_tools exists
+    if "server_tools" not in config:
+        config["server_tools"] = []
+    return config
+
+
+# Largest page the /howto listing and /api/howto/posts will return
+MAX_POSTS_PER_PAGE = 50
+
+# Rendered /howto pages for anonymous visitors; see http_cache.PageCache
+FORUM_PAGE_CACHE_SIZE = 256
+forum_page_cache = PageCache(FORUM_PAGE_CACHE_SIZE)
+
+# Gzip text responses for clients that accept it; see http_cache.compress_response
+app.after_request(compress_response)
+
+
+# Full-text index behind the /howto search box; see search_index.SearchIndex
+post_search = SearchIndex()
+post_suggest = SuggestIndex()
+
+
+# The remaining JSON files, also written under a lock file so several workers can share them
+chats_file = JsonDocument(CHATS_PATH, list)
+admins_file = JsonDocument(ADMINS_PATH, list)
+external_tools_file = JsonDocument(EXTERNAL_TOOLS_CONFIG_PATH, default_external_tools_config, normalize_external_tools_config)
+
+
+# Validators for conditional GETs (see http_cache.conditional): the versions of
+# the data a view reads, plus the session for pages that render per user
+def session_variant():
+    return tuple(sorted(session.items()))
+
+
+def page_validators(*signatures):
+    return (signatures, session_variant()), newest_mtime(*signatures)
+
+
+def home_validators():
+    return page_validators(content_store.categories.signature(), content_store.resources.signature())
+
+
+def forum_validators():
+    return page_validators(content_store.posts.snapshot().signature,
+                           content_store.categories.signature(), content_store.resources.signature())
+
+
+def post_validators(post_id):
+    return page_validators(content_store.posts.snapshot().signature)
+
+
+def posts_api_validators():
+    signatures = (content_store.posts.snapshot().signature, content_store.categories.signature())
+    return signatures, newest_mtime(*signatures)
+
+
+def resources_validators(category=None):
+    signatures = (content_store.categories.signature(), content_store.resources.signature())
+    return signatures, newest_mtime(*signatures)
+
+
+def chat_validators():
+    return page_validators(chats_file.signature())
+
+
+def data_tables_validators(table_name=None):
+    return page_validators(db_signature(DATABASE_PATH))
 
 
 def cleanup_chat_on_startup():
@@ -44,16 +177,13 @@ def cleanup_chat_on_startup():
     try:
         # Load existing chats to get image filenames before clearing
         chat_images = []
-        if os.path.exists(CHATS_PATH):
-            with open(CHATS_PATH, 'r', encoding='utf-8') as f:
-                chats = json.load(f)
-                for chat in chats:
-                    if chat.get('image'):
-                        chat_images.append(chat['image'])
-        
-        # Clear the chat.json file
-        with open(CHATS_PATH, 'w', encoding='utf-8') as f:
-            json.dump([], f, indent=2, ensure_ascii=False)
+        with chats_file.editing() as chats:
+            for chat in chats:
+                if chat.get('image'):
+                    chat_images.append(chat['image'])
+            
+            # Clear the chat.json file
+            chats.clear()
         
         # Remove chat image files from uploads folder
         for image_name in chat_images:
@@ -90,105 +220,42 @@ def cleanup_chat_on_startup():
 cleanup_chat_on_startup()
 
 
-def load_posts():
-    if not os.path.exists(POSTS_PATH):
-        return []
-    with open(POSTS_PATH, 'r', encoding='utf-8') as f:
-        posts = json.load(f)
-        for p in posts:
-            p.setdefault('embedded', [])
-            p.setdefault('tags', [])  # Ensure tags field always exists
-        return posts
-
-
-def save_posts(posts):
-    with open(POSTS_PATH, 'w', encoding='utf-8') as f:
-        json.dump(posts, f, indent=2, ensure_ascii=False)
-
-
 def load_categories():
-    if not os.path.exists(CATEGORIES_PATH):
-        return ['General']
-    with open(CATEGORIES_PATH, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return thaw(content_store.categories.snapshot())
 
 
 def save_categories(categories):
-    with open(CATEGORIES_PATH, 'w', encoding='utf-8') as f:
-        json.dump(categories, f, indent=2, ensure_ascii=False)
-
-
-RESOURCES_PATH = os.path.join(app.root_path, "resources.json")
+    content_store.categories.save(categories)
 
 
 def load_resources():
-    if not os.path.exists(RESOURCES_PATH):
-        return []
-    with open(RESOURCES_PATH, "r", encoding='utf-8') as f:
-        resources = json.load(f)
-        # Ensure backwards compatibility - add category field if missing
-        for resource in resources:
-            resource.setdefault('category', 'General')
-        return resources
+    return thaw(content_store.resources.snapshot())
 
 
 def save_resources(resources):
-    with open(RESOURCES_PATH, "w", encoding='utf-8') as f:
-        json.dump(resources, f, indent=2, ensure_ascii=False)
+    content_store.resources.save(resources)
 
 
 def load_chats():
-    if not os.path.exists(CHATS_PATH):
-        return []
-    with open(CHATS_PATH, "r", encoding='utf-8') as f:
-        return json.load(f)
+    return thaw(chats_file.snapshot())
 
 
 def save_chats(chats):
-    with open(CHATS_PATH, "w", encoding='utf-8') as f:
-        json.dump(chats, f, indent=2, ensure_ascii=False)
+    chats_file.save(chats)
 
 
 def load_admins():
-    if not os.path.exists(ADMINS_PATH):
-        return []
-    with open(ADMINS_PATH, "r", encoding='utf-8') as f:
-        return json.load(f)
+    return thaw(admins_file.snapshot())
 
 
 def save_admins(admins):
-    with open(ADMINS_PATH, "w", encoding='utf-8') as f:
-        json.dump(admins, f, indent=2, ensure_ascii=False)
+    admins_file.save(admins)
 
 
 def load_external_tools_config():
     """Load external tools configuration."""
-    if not os.path.exists(EXTERNAL_TOOLS_CONFIG_PATH):
-        # Return default config if file doesn't exist
-        return {
-            "server_tools": [],
-            "settings": {
-                "allow_custom_tools": True,
-                "allow_user_tools": True,
-                "require_admin_approval": False,
-                "log_tool_usage": True,
-                "max_user_tools": 10
-            }
-        }
-    
     try:
-        with open(EXTERNAL_TOOLS_CONFIG_PATH, "r", encoding='utf-8') as f:
-            config = json.load(f)
-            
-            # Handle legacy format
-            if "tools" in config and "server_tools" not in config:
-                config["server_tools"] = config.pop("tools", [])
-            
-            # Ensure server_tools exists
-            if "server_tools" not in config:
-                config["server_tools"] = []
-                
-            return config
+        return thaw(external_tools_file.snapshot())
     except Exception as e:
         print(f"Error loading external tools config: {e}")
         return {"server_tools": [], "settings": {}}
@@ -197,8 +264,7 @@ def load_external_tools_config():
 def save_external_tools_config(config):
     """Save external tools configuration."""
     try:
-        with open(EXTERNAL_TOOLS_CONFIG_PATH, "w", encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        external_tools_file.save(config)
         return True
     except Exception as e:
         print(f"Error saving external tools config: {e}")
@@ -210,6 +276,35 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_ATTACH_EXTENSIONS
 
 
+def allowed_resource(filename):
+    return os.path.splitext(filename)[1].lower() in RESOURCE_EXTENSIONS
+
+
+def resource_type_error():
+    return 'Resource files must be ' + ', '.join(sorted(RESOURCE_EXTENSIONS))
+
+
+def place_resource(path, name):
+    """
+    Move a finished upload into the resource folder as name. Returns False,
+    leaving the file where it is, if a file of that name already exists:
+    an upload never replaces another file.
+    """
+    target = os.path.join(app.root_path, name)
+    try:
+        os.link(path, target)
+    except FileExistsError:
+        return False
+    except OSError:
+        # No hard links on this drive; check and move in two steps instead
+        if os.path.exists(target):
+            return False
+        shutil.move(path, target)
+        return True
+    os.remove(path)
+    return True
+
+
 def clean_content(content):
     """Clean content to remove unwanted characters that might be introduced"""
     if not content:
@@ -227,21 +322,30 @@ def clean_content(content):
     return content.strip()
 
 
-def save_uploaded_files(files):
+def save_uploaded_files(files, existing=()):
+    """
+    Store attachment uploads and return their names, after the names in
+    existing: files the browser found already on the server and so didn't send.
+    """
     saved = []
+    for name in existing:
+        if (upload_digest(name) and name == os.path.basename(name) and allowed_file(name)
+                and os.path.isfile(os.path.join(UPLOAD_FOLDER, name)) and name not in saved):
+            saved.append(name)
     for f in files:
         if f and allowed_file(f.filename):
-            name = datetime.utcnow().strftime('%Y%m%d%H%M%S_') + secure_filename(f.filename)
-            path = os.path.join(UPLOAD_FOLDER, name)
-            f.save(path)
-            saved.append(name)
+            name = save_upload(UPLOAD_FOLDER, f.stream, f.filename)
+            schedule_derivatives(UPLOAD_FOLDER, name)
+            if name not in saved:
+                saved.append(name)
     return saved
 
 
 @app.route('/')
+@conditional(home_validators, 'no-cache', per_session=True)
 def index():
-    resources = load_resources()
-    categories = load_categories()
+    resources = content_store.resources.snapshot()
+    categories = content_store.categories.snapshot()
     
     # Organize resources by category
     resources_by_category = {}
@@ -259,19 +363,98 @@ def index():
     return render_template('index.html', resources=resources, resources_by_category=resources_by_category, categories=categories)
 
 
+def is_anonymous():
+    """True when nothing in the session changes how a page renders."""
+    return not session.get('logged_in') and not session.get('secret_admin') and 'username' not in session
+
+
+def forum_args():
+    """Parse the /howto query string into the values the page depends on."""
+    return {
+        # Get pagination and sorting parameters
+        'page': int(request.args.get('page', 1)),
+        'per_page': min(max(int(request.args.get('per_page', 10)), 1), MAX_POSTS_PER_PAGE),
+        'sort_by': request.args.get('sort_by', 'newest'),  # newest, oldest, title
+        'category_filter': request.args.get('category', 'all'),
+        'search_query': request.args.get('search', '').strip().lower(),
+        'tag_filters': request.args.get('tags', '').strip(),
+    }
+
+
 @app.route('/howto')
+@conditional(forum_validators, 'no-cache', per_session=True)
 def forum():
-    original_posts = load_posts()
-    categories = load_categories()
-    resources = load_resources()
-    
-    # Get pagination and sorting parameters
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 10))
-    sort_by = request.args.get('sort_by', 'newest')  # newest, oldest, title
-    category_filter = request.args.get('category', 'all')
-    search_query = request.args.get('search', '').strip().lower()
-    tag_filters = request.args.get('tags', '').strip()
+    args = forum_args()
+    if not is_anonymous():
+        return render_forum(**args)
+    
+    # Anonymous pages depend only on the arguments and the content, so they are cached
+    version = content_store.current_version()
+    key = tuple(sorted(args.items()))
+    page = forum_page_cache.get(version, key)
+    if page is None:
+        page = CachedPage(render_forum(**args))
+        forum_page_cache.put(version, key, page)
+    return page.response()
+
+
+def listing_order(sort_by, search_query):
+    """Return the order a /howto listing uses; 'relevance' is only possible when searching."""
+    if sort_by in SORT_ORDERS or (sort_by == 'relevance' and search_query):
+        return sort_by
+    return 'newest'
+
+
+def listing_ids(posts, order, match_bits, search_query, after=None):
+    """
+    Return (post IDs, search hits) for the posts in match_bits in listing order.
+
+    The IDs are a lazy iterator resuming after the (key, post_id) of a cursor
+    when after is given. With a search query only matching posts are listed
+    and hits maps each match to its score; otherwise hits is None.
+    """
+    index = posts.index
+    if not search_query:
+        return index.ids_after(order, match_bits, *(after or ())), None
+    hits = post_search.search(posts, search_query)
+    if order != 'relevance':
+        return (post_id for post_id in index.ids_after(order, match_bits, *(after or ())) if post_id in hits), hits
+    # Best match first; ties broken by ID so a cursor marks an exact position
+    ranked = sorted(hits, key=lambda post_id: (-hits[post_id], post_id))
+    start = bisect_right(ranked, (-after[0], after[1]), key=lambda post_id: (-hits[post_id], post_id)) if after else 0
+    return (post_id for post_id in islice(ranked, start, None) if index.contains(match_bits, post_id)), hits
+
+
+def listing_cursor(index, order, post_id, hits):
+    """Return the cursor for continuing a listing after post_id."""
+    if order == 'relevance':
+        return encode_cursor(order, hits[post_id], post_id)
+    return index.cursor(order, post_id)
+
+
+def forum_facets(posts, categories, selected_category, tag_list, search_query, hits=None):
+    """
+    Return post counts for the /howto sidebar under the active filters (see PostIndex.facet_counts).
+
+    categories maps every configured category (plus 'All Posts') to its count
+    and tags maps every tag in use to its count.
+    """
+    index = posts.index
+    within = None
+    if search_query:
+        if hits is None:
+            hits = post_search.search(posts, search_query)
+        within = index.bits_of(hits)
+    facets = index.facet_counts(selected_category, tag_list, within)
+    category_counts = {'All Posts': facets['any_category']}
+    for cat in categories:
+        category_counts[cat] = facets['categories'].get(cat, 0)
+    return {'categories': category_counts, 'tags': facets['tags'], 'total': facets['total']}
+
+
+def render_forum(page, per_page, sort_by, category_filter, search_query, tag_filters):
+    categories = content_store.categories.snapshot()
+    resources = content_store.resources.snapshot()
     
     # Organize resources by category
     resources_by_category = {}
@@ -289,75 +472,58 @@ def forum():
         # If viewing all posts, show only General category resources
         category_resources = resources_by_category.get('General', [])
     
-    # Add default values and create posts with original indices
-    posts_with_indices = []
-    for original_idx, p in enumerate(original_posts):
-        p.setdefault('category', 'General')
-        p.setdefault('created', datetime.utcnow().strftime('%Y-%m-%d %H:%M'))
-        p.setdefault('tags', [])  # Ensure tags field exists
-        posts_with_indices.append({'original_idx': original_idx, 'post': p})
-    
-    tags = sorted({t for item in posts_with_indices for t in item['post'].get('tags', [])})
+    # Category and tag filters are bitset intersections over the post index
+    # One snapshot for the whole request, so a concurrent write can't change the listing halfway
+    posts = content_store.posts.snapshot()
+    index = posts.index
+    tags = sorted(index.tag_counts())
+    tag_list = [tag.strip() for tag in tag_filters.split(',') if tag.strip()]
+    selected_category = category_filter if category_filter != 'all' and category_filter in categories else None
     
     # Add "All Posts" as the first category
-    all_categories = ['All Posts'] + categories
+    all_categories = ['All Posts'] + list(categories)
     
-    # Sort posts based on sort_by parameter
-    if sort_by == 'oldest':
-        posts_with_indices.sort(key=lambda x: x['post'].get('created', ''))
-    elif sort_by == 'title':
-        posts_with_indices.sort(key=lambda x: x['post'].get('title', '').lower())
-    else:  # newest (default)
-        posts_with_indices.sort(key=lambda x: x['post'].get('created', ''), reverse=True)
+    def entries_for(post_ids):
+        return [{'post': posts.entry(post_id)} for post_id in post_ids]
     
-    # Filter posts by category if not "all"
-    if category_filter != 'all' and category_filter in categories:
-        filtered_posts = [item for item in posts_with_indices if item['post'].get('category', 'General') == category_filter]
-    else:
-        filtered_posts = posts_with_indices
+    # Sort orders are maintained by the index, so a page is a walk over an existing order
+    order = listing_order(sort_by, search_query)
+    match_bits = index.match(category=selected_category, tags=tag_list)
+    start_idx = (page - 1) * per_page
+    end_idx = start_idx + per_page
+    hits = None
     
     # Apply search filter if provided
     if search_query:
-        search_filtered = []
-        for item in filtered_posts:
-            post = item['post']
-            # Search in title and content
-            title_match = search_query in post.get('title', '').lower()
-            content_match = search_query in post.get('content', '').lower()
-            if title_match or content_match:
-                search_filtered.append(item)
-        filtered_posts = search_filtered
-    
-    # Apply tag filters if provided
-    if tag_filters:
-        tag_list = [tag.strip() for tag in tag_filters.split(',') if tag.strip()]
-        if tag_list:
-            tag_filtered = []
-            for item in filtered_posts:
-                post_tags = item['post'].get('tags', [])
-                # Check if all selected tags are in the post's tags
-                if all(tag in post_tags for tag in tag_list):
-                    tag_filtered.append(item)
-            filtered_posts = tag_filtered
+        # Ranked full-text search over titles, bodies and comments (see search_index.py)
+        post_ids, hits = listing_ids(posts, order, match_bits, search_query)
+        search_filtered = list(post_ids)
+        total_posts = len(search_filtered)
+        paginated_posts = entries_for(search_filtered[start_idx:end_idx] if start_idx >= 0 else [])
+        for item in paginated_posts:
+            item['snippet'] = post_search.snippet(item['post']['id'], search_query)
+    else:
+        total_posts = index.count(match_bits)
+        paginated_posts = entries_for(index.page_ids(order, match_bits, start_idx, per_page))
     
     # Calculate pagination
-    total_posts = len(filtered_posts)
     total_pages = (total_posts + per_page - 1) // per_page
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    paginated_posts = filtered_posts[start_idx:end_idx]
     
     # Build posts by category structure
     posts_by_cat = {c: [] for c in all_categories}
     
     # Add all posts to "All Posts" category (paginated)
     for item in paginated_posts:
-        posts_by_cat['All Posts'].append({'index': item['original_idx'], 'post': item['post']})
+        posts_by_cat['All Posts'].append({'id': item['post']['id'], 'post': item['post'], 'snippet': item.get('snippet')})
     
-    # Add posts to their specific categories (not paginated for category tabs)
-    for item in posts_with_indices:
-        cat = item['post'].get('category', 'General')
-        posts_by_cat.setdefault(cat, []).append({'index': item['original_idx'], 'post': item['post']})
+    # Category tabs only show counts; their posts load from /api/howto/posts when opened.
+    # Counts follow the tag and search filters, so the sidebar shows where each choice leads
+    facets = forum_facets(posts, categories, selected_category, tag_list, search_query, hits)
+    
+    # Where infinite scroll continues from (see /api/howto/posts)
+    next_cursor = None
+    if paginated_posts and page < total_pages:
+        next_cursor = listing_cursor(index, order, paginated_posts[-1]['post']['id'], hits)
     
     # Pagination info
     pagination = {
@@ -368,7 +534,8 @@ def forum():
         'has_prev': page > 1,
         'has_next': page < total_pages,
             'prev_num': page - 1 if page > 1 else None,
-            'next_num': page + 1 if page < total_pages else None
+            'next_num': page + 1 if page < total_pages else None,
+        'next_cursor': next_cursor
     }
 
     return render_template(
@@ -376,8 +543,10 @@ def forum():
         categories=all_categories,
         tags=tags,
         posts_by_cat=posts_by_cat,
+        category_counts=facets['categories'],
+        tag_counts=facets['tags'],
         pagination=pagination,
-        sort_by=sort_by,
+        sort_by=order,
         category_filter=category_filter,
         per_page=per_page,
         search_query=search_query,
@@ -505,7 +674,6 @@ def register():
 def chat():
     if not session.get('logged_in'):
         return redirect(url_for('login'))
-    chats = load_chats()
     if request.method == 'POST':
         text = request.form.get('text', '').strip()
         image_file = request.files.get('image')
@@ -520,18 +688,19 @@ def chat():
                 image_name = name
         if text or image_name:
             name = (f"{session.get('first','')} {session.get('last','')}").strip() or session.get('username', 'Admin')
-            chats.append({
-                'name': name,
-                'text': text,
-                'image': image_name,
-                'created': datetime.utcnow().strftime('%Y-%m-%d %H:%M')
-            })
-            save_chats(chats)
+            with chats_file.editing() as chats:
+                chats.append({
+                    'name': name,
+                    'text': text,
+                    'image': image_name,
+                    'created': datetime.utcnow().strftime('%Y-%m-%d %H:%M')
+                })
             return redirect(url_for('chat'))
-    return render_template('chat.html', messages=chats)
+    return render_template('chat.html', messages=load_chats())
 
 
 @app.route('/chat-data')
+@conditional(chat_validators, 'private, no-cache', per_session=True)
 def chat_data():
     if not session.get('logged_in'):
         return jsonify({'error': 'unauthorized'}), 401
@@ -563,9 +732,8 @@ def manage_admins():
                 
         elif action == 'delete_legacy' and username:
             try:
-                legacy_admins = load_admins()
-                legacy_admins = [a for a in legacy_admins if a.get('username') != username]
-                save_admins(legacy_admins)
+                with admins_file.editing() as legacy_admins:
+                    legacy_admins[:] = [a for a in legacy_admins if a.get('username') != username]
                 success = f"Legacy admin {username} removed"
             except Exception as e:
                 error = f"Error removing legacy admin: {str(e)}"
@@ -606,58 +774,47 @@ def manage_admins():
 def manage_categories():
     if not session.get('logged_in'):
         return redirect(url_for('login'))
-    categories = load_categories()
     error = None
     if request.method == 'POST':
         action = request.form.get('action', 'add')
-        if action == 'add':
-            new_cat = request.form.get('category', '').strip()
-            if new_cat and new_cat not in categories:
-                categories.append(new_cat)
-                save_categories(categories)
-            else:
-                error = 'Invalid or duplicate category'
-        elif action == 'edit':
-            old = request.form.get('old', '')
-            new = request.form.get('new', '').strip()
-            if old in categories and new and new not in categories:
-                posts = load_posts()
-                for p in posts:
-                    if p.get('category') == old:
-                        p['category'] = new
-                save_posts(posts)
-                
-                # Also update resources with the old category
-                resources = load_resources()
-                for r in resources:
-                    if r.get('category') == old:
-                        r['category'] = new
-                save_resources(resources)
-                
-                categories[categories.index(old)] = new
-                save_categories(categories)
-            else:
-                error = 'Invalid category name'
-        elif action == 'delete':
-            name = request.form.get('name', '')
-            if name in categories and name != 'General':
-                posts = load_posts()
-                for p in posts:
-                    if p.get('category') == name:
-                        p['category'] = 'General'
-                save_posts(posts)
-                
-                # Also move resources from deleted category to General
-                resources = load_resources()
-                for r in resources:
-                    if r.get('category') == name:
-                        r['category'] = 'General'
-                save_resources(resources)
-                
-                categories.remove(name)
-                save_categories(categories)
-            else:
-                error = 'Cannot delete category'
+        # Hold the categories lock across the read-modify-write so concurrent edits are not lost
+        with content_store.categories.editing() as categories:
+            if action == 'add':
+                new_cat = request.form.get('category', '').strip()
+                if new_cat and new_cat not in categories:
+                    categories.append(new_cat)
+                else:
+                    error = 'Invalid or duplicate category'
+            elif action == 'edit':
+                old = request.form.get('old', '')
+                new = request.form.get('new', '').strip()
+                if old in categories and new and new not in categories:
+                    content_store.posts.apply('category_renamed', old=old, new=new)
+                    
+                    # Also update resources with the old category
+                    with content_store.resources.editing() as resources:
+                        for r in resources:
+                            if r.get('category') == old:
+                                r['category'] = new
+                    
+                    categories[categories.index(old)] = new
+                else:
+                    error = 'Invalid category name'
+            elif action == 'delete':
+                name = request.form.get('name', '')
+                if name in categories and name != 'General':
+                    content_store.posts.apply('category_renamed', old=name, new='General')
+                    
+                    # Also move resources from deleted category to General
+                    with content_store.resources.editing() as resources:
+                        for r in resources:
+                            if r.get('category') == name:
+                                r['category'] = 'General'
+                    
+                    categories.remove(name)
+                else:
+                    error = 'Cannot delete category'
+    categories = load_categories()
     return render_template('categories.html', categories=categories, error=error)
 
 
@@ -665,7 +822,6 @@ def manage_categories():
 def manage_resources():
     if not session.get('logged_in'):
         return redirect(url_for('login'))
-    resources = load_resources()
     error = None
     if request.method == 'POST':
         action = request.form.get('action', 'add')
@@ -678,12 +834,24 @@ def manage_resources():
             path = ''
             if rtype == 'download':
                 file = request.files.get('file')
-                if not file or file.filename == '':
+                uploaded = request.form.get('uploaded_file', '')
+                if (not file or file.filename == '') and uploaded in session.get('chunked_resources', []):
+                    # Sent ahead through the chunked upload
+                    path = uploaded
+                elif not file or file.filename == '':
                     error = 'File required'
                 else:
                     fname = secure_filename(file.filename or '')
-                    file.save(os.path.join(app.root_path, fname))
-                    path = fname
+                    if not allowed_resource(fname):
+                        error = resource_type_error()
+                    else:
+                        try:
+                            # Exclusive create: an upload never replaces another file
+                            with open(os.path.join(app.root_path, fname), 'xb') as f:
+                                file.save(f)
+                            path = fname
+                        except FileExistsError:
+                            error = f'A file named {fname} already exists'
             elif rtype == 'url':
                 path = request.form.get('url', '').strip()
                 if not path:
@@ -704,31 +872,34 @@ def manage_resources():
                     else:
                         error = 'File path must be a valid local path or file:// URL'
             if not error and title:
-                resources.append({'title': title, 'description': desc, 'type': rtype, 'path': path, 'dynamic': dynamic, 'category': category})
-                save_resources(resources)
+                with content_store.resources.editing() as resources:
+                    resources.append({'title': title, 'description': desc, 'type': rtype, 'path': path, 'dynamic': dynamic, 'category': category})
                 return redirect(url_for('manage_resources'))
             elif not title:
                 error = 'Title required'
         elif action == 'delete':
             idx = int(request.form.get('index', -1))
-            if 0 <= idx < len(resources):
-                resources.pop(idx)
-                save_resources(resources)
+            with content_store.resources.editing() as resources:
+                found = 0 <= idx < len(resources)
+                if found:
+                    resources.pop(idx)
+            if found:
                 return redirect(url_for('manage_resources'))
         elif action == 'edit':
             idx = int(request.form.get('index', -1))
-            if 0 <= idx < len(resources):
-                title = request.form.get('title', '').strip()
-                desc = request.form.get('description', '').strip()
-                category = request.form.get('category', 'General').strip()
-                if title:
+            title = request.form.get('title', '').strip()
+            desc = request.form.get('description', '').strip()
+            category = request.form.get('category', 'General').strip()
+            with content_store.resources.editing() as resources:
+                found = 0 <= idx < len(resources)
+                if found and title:
                     resources[idx]['title'] = title
                     resources[idx]['description'] = desc
                     resources[idx]['category'] = category
-                    save_resources(resources)
-                    return redirect(url_for('manage_resources'))
-                else:
-                    error = 'Title required'
+            if found and title:
+                return redirect(url_for('manage_resources'))
+            elif found:
+                error = 'Title required'
     
     # Load custom data tables for reference
     try:
@@ -739,7 +910,7 @@ def manage_resources():
         custom_tables = []
     
     return render_template('resources_admin.html', 
-                         resources=resources, 
+                         resources=load_resources(), 
                          categories=load_categories(), 
                          custom_tables=custom_tables,
                          error=error)
@@ -750,15 +921,14 @@ def new_post():
     if not session.get('logged_in'):
         return redirect(url_for('login'))
     if request.method == 'POST':
-        posts = load_posts()
-        attachments = save_uploaded_files(request.files.getlist('attachments'))
-        embedded = [f for f in request.form.get('embedded_images', '').split(',') if f]
+        attachments = save_uploaded_files(request.files.getlist('attachments'), request.form.getlist('existing_attachments'))
+        embedded = list(dict.fromkeys(f for f in request.form.get('embedded_images', '').split(',') if f))
         tags = [t.strip() for t in request.form.get('tags', '').split(',') if t.strip()]
         
         # Clean the content to remove unwanted characters
         content = clean_content(request.form['content'])
         
-        posts.insert(0, {
+        content_store.posts.apply('post_created', post={
             'title': request.form['title'].strip(),
             'content': content,
             'author': 'Admin',
@@ -769,7 +939,6 @@ def new_post():
             'category': request.form['category'],
             'tags': tags
         })
-        save_posts(posts)
         return redirect(url_for('forum'))
     categories = load_categories()
     return render_template('newpost.html', post=None, categories=categories)
@@ -796,8 +965,8 @@ def tag_manager_html():
 <script>
     // Initialize the tag manager when the page loads
     document.addEventListener('DOMContentLoaded', function() {
-        // Replace POST_INDEX with the actual post index
-        initTagManager({{ index if index is defined else 0 }});
+        // Replace POST_ID with the actual post ID
+        initTagManager('{{ post_id if post_id is defined else '' }}');
     });
 </script>
 
@@ -817,7 +986,7 @@ def tag_manager_html():
 def tag_manager_js():
     """Return JavaScript code for the tag manager"""
     js_code = '''
-function initTagManager(postIndex) {
+function initTagManager(postId) {
     const tagContainer = document.getElementById('tag-container');
     const addTagBtn = document.getElementById('add-tag-btn');
     const newTagInput = document.getElementById('new-tag-input');
@@ -831,7 +1000,7 @@ function initTagManager(postIndex) {
     loadTags();
     
     function loadTags() {
-        fetch(`/post-tags/${postIndex}`)
+        fetch(`/post-tags/${postId}`)
             .then(response => response.json())
             .then(data => {
                 if (data.tags) {
@@ -881,7 +1050,7 @@ function initTagManager(postIndex) {
         const tag = newTagInput.value.trim();
         if (!tag) return;
         
-        fetch(`/post-tags/${postIndex}`, {
+        fetch(`/post-tags/${postId}`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ tag: tag })
@@ -902,7 +1071,7 @@ function initTagManager(postIndex) {
     }
     
     function removeTag(tag) {
-        fetch(`/post-tags/${postIndex}`, {
+        fetch(`/post-tags/${postId}`, {
             method: 'DELETE',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ tag: tag })
@@ -934,7 +1103,7 @@ function initTagManager(postIndex) {
         }
     };
     
-    console.log('Tag manager initialized for post', postIndex);
+    console.log('Tag manager initialized for post', postId);
 }
 '''
     
@@ -946,18 +1115,16 @@ function initTagManager(postIndex) {
     return response
 
 
-@app.route('/post-tags/<int:index>', methods=['GET', 'POST', 'DELETE'])
-def manage_post_tags(index):
+@app.route('/post-tags/<post_id>', methods=['GET', 'POST', 'DELETE'])
+def manage_post_tags(post_id):
     """API endpoint for managing tags on a specific post"""
     if not session.get('logged_in'):
         return jsonify({'error': 'Not authenticated'}), 401
     
-    posts = load_posts()
-    if index < 0 or index >= len(posts):
+    post = content_store.posts.get(post_id)
+    if post is None:
         return jsonify({'error': 'Post not found'}), 404
     
-    post = posts[index]
-    
     if request.method == 'GET':
         # Return current tags
         return jsonify({
@@ -973,8 +1140,9 @@ def manage_post_tags(index):
             # Add a single tag
             new_tag = data['tag'].strip()
             if new_tag and new_tag not in post.get('tags', []):
-                post.setdefault('tags', []).append(new_tag)
-                save_posts(posts)
+                post = content_store.posts.apply('tag_added', id=post_id, tag=new_tag)
+                if post is None:
+                    return jsonify({'error': 'Post not found'}), 404
                 return jsonify({'success': True, 'tags': post['tags']})
             else:
                 return jsonify({'error': 'Tag already exists or is empty'}), 400
@@ -982,8 +1150,9 @@ def manage_post_tags(index):
         elif 'tags' in data:
             # Set all tags (replace existing)
             new_tags = [tag.strip() for tag in data['tags'] if tag.strip()]
-            post['tags'] = new_tags
-            save_posts(posts)
+            post = content_store.posts.apply('post_updated', id=post_id, fields={'tags': new_tags})
+            if post is None:
+                return jsonify({'error': 'Post not found'}), 404
             return jsonify({'success': True, 'tags': post['tags']})
         
         else:
@@ -995,8 +1164,9 @@ def manage_post_tags(index):
         tag_to_remove = data.get('tag', '').strip()
         
         if tag_to_remove and tag_to_remove in post.get('tags', []):
-            post['tags'].remove(tag_to_remove)
-            save_posts(posts)
+            post = content_store.posts.apply('tag_removed', id=post_id, tag=tag_to_remove)
+            if post is None:
+                return jsonify({'error': 'Post not found'}), 404
             return jsonify({'success': True, 'tags': post['tags']})
         else:
             return jsonify({'error': 'Tag not found'}), 404
@@ -1005,19 +1175,18 @@ def manage_post_tags(index):
     return jsonify({'error': 'Invalid request method'}), 405
 
 
-@app.route('/debug-tags/<int:index>')
-def debug_tags(index):
+@app.route('/debug-tags/<post_id>')
+def debug_tags(post_id):
     """Debug route to inspect tag data for a specific post"""
     if not session.get('logged_in') or not session.get('secret_admin'):
         return {'error': 'unauthorized'}, 401
     
-    posts = load_posts()
-    if index < 0 or index >= len(posts):
+    post = content_store.posts.get(post_id)
+    if post is None:
         return {'error': 'Post not found'}, 404
     
-    post = posts[index]
     return {
-        'index': index,
+        'id': post_id,
         'title': post.get('title', 'No title'),
         'tags': post.get('tags', []),
         'tags_type': str(type(post.get('tags', []))),
@@ -1026,11 +1195,98 @@ def debug_tags(index):
     }
 
 
+@app.route('/api/howto/posts')
+@conditional(posts_api_validators, 'public, no-cache')
+def api_howto_posts():
+    """
+    API endpoint returning forum post summaries a page at a time, for infinite scroll.
+
+    Takes the /howto filters (sort_by, category, tags, search) plus limit and
+    the cursor from the previous response; next_cursor is null on the last page.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), MAX_POSTS_PER_PAGE)
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    
+    category = request.args.get('category', 'all')
+    search_query = request.args.get('search', '').strip().lower()
+    order = listing_order(request.args.get('sort_by', 'newest'), search_query)
+    if after and after[0] != order:
+        return jsonify({'error': 'Cursor belongs to a different sort order'}), 400
+    tag_list = [tag.strip() for tag in request.args.get('tags', '').split(',') if tag.strip()]
+    
+    posts = content_store.posts.snapshot()
+    index = posts.index
+    selected_category = category if category != 'all' and category in content_store.categories.snapshot() else None
+    match_bits = index.match(category=selected_category, tags=tag_list)
+    
+    post_ids, hits = listing_ids(posts, order, match_bits, search_query, after[1:] if after else None)
+    # One extra to learn whether another page follows
+    page_ids = list(islice(post_ids, limit + 1))
+    next_cursor = listing_cursor(index, order, page_ids[limit - 1], hits) if len(page_ids) > limit else None
+    
+    records = []
+    for post_id in page_ids[:limit]:
+        record = posts.entry(post_id)
+        snippet = post_search.snippet(post_id, search_query) if search_query else None
+        # Highlighted search context, already HTML-escaped
+        records.append(dict(record, snippet=str(snippet)) if snippet else record)
+    
+    if search_query:
+        total = sum(1 for post_id in hits if index.contains(match_bits, post_id))
+    else:
+        total = index.count(match_bits)
+    
+    return jsonify({
+        'posts': records,
+        'next_cursor': next_cursor,
+        'sort_by': order,
+        'total': total
+    })
+
+
+@app.route('/api/howto/facets')
+@conditional(posts_api_validators, 'public, no-cache')
+def api_howto_facets():
+    """API endpoint with post counts per category and tag under the /howto filters (category, tags, search)."""
+    category = request.args.get('category', 'all')
+    search_query = request.args.get('search', '').strip().lower()
+    tag_list = [tag.strip() for tag in request.args.get('tags', '').split(',') if tag.strip()]
+    
+    posts = content_store.posts.snapshot()
+    categories = content_store.categories.snapshot()
+    selected_category = category if category != 'all' and category in categories else None
+    facets = forum_facets(posts, categories, selected_category, tag_list, search_query)
+    
+    return jsonify({
+        'categories': [{'category': name, 'count': count} for name, count in facets['categories'].items()],
+        'tags': [{'tag': tag, 'count': facets['tags'][tag]} for tag in sorted(facets['tags'])],
+        'total': facets['total']
+    })
+
+
+@app.route('/api/howto/suggest')
+@conditional(posts_api_validators, 'public, no-cache')
+def api_howto_suggest():
+    """API endpoint suggesting post titles, tags and categories for a search box prefix (q)."""
+    try:
+        limit = min(max(int(request.args.get('limit', 8)), 1), 20)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    query = request.args.get('q', '')
+    suggestions = post_suggest.suggest(content_store.posts.snapshot(), content_store.categories.snapshot(), query, limit)
+    return jsonify(dict(suggestions, q=query))
+
+
 @app.route('/api/resources')
+@conditional(resources_validators, 'public, no-cache')
 def api_resources():
     """API endpoint to get all resources organized by category"""
-    resources = load_resources()
-    categories = load_categories()
+    resources = content_store.resources.snapshot()
+    categories = content_store.categories.snapshot()
     
     # Organize resources by category
     resources_by_category = {}
@@ -1048,9 +1304,10 @@ def api_resources():
 
 
 @app.route('/api/resources/<category>')
+@conditional(resources_validators, 'public, no-cache')
 def api_resources_by_category(category):
     """API endpoint to get resources for a specific category"""
-    resources = load_resources()
+    resources = content_store.resources.snapshot()
     category_resources = [r for r in resources if r.get('category', 'General') == category]
     
     return jsonify({
@@ -1066,16 +1323,13 @@ def cleanup_resources():
     if not session.get('logged_in') or not session.get('secret_admin'):
         return redirect(url_for('login'))
     
-    resources = load_resources()
     updated_count = 0
     
-    for resource in resources:
-        if 'category' not in resource:
-            resource['category'] = 'General'
-            updated_count += 1
-    
-    if updated_count > 0:
-        save_resources(resources)
+    with content_store.resources.editing() as resources:
+        for resource in resources:
+            if 'category' not in resource:
+                resource['category'] = 'General'
+                updated_count += 1
     
     return {
         'success': True, 
@@ -1090,38 +1344,39 @@ def cleanup_posts():
     if not session.get('logged_in') or not session.get('secret_admin'):
         return redirect(url_for('login'))
     
-    posts = load_posts()
     cleaned_count = 0
     tag_fixes = 0
     comment_fixes = 0
     
-    for post in posts:
+    def clean_post(post):
+        nonlocal cleaned_count, tag_fixes, comment_fixes
+        fields = {}
         if 'content' in post:
-            original_content = post['content']
-            cleaned_content = clean_content(original_content)
-            if original_content != cleaned_content:
-                post['content'] = cleaned_content
+            cleaned_content = clean_content(post['content'])
+            if post['content'] != cleaned_content:
+                fields['content'] = cleaned_content
                 cleaned_count += 1
         
-        if 'title' in post:
-            post['title'] = post['title'].strip()
+        if 'title' in post and post['title'] != post['title'].strip():
+            fields['title'] = post['title'].strip()
         
         # Ensure tags field exists and is a list
-        if 'tags' not in post:
-            post['tags'] = []
-            tag_fixes += 1
-        elif not isinstance(post['tags'], list):
-            post['tags'] = []
+        if not isinstance(post.get('tags'), list):
+            fields['tags'] = []
             tag_fixes += 1
         
         # Ensure comments have IDs
         comments = post.get('comments', [])
-        for comment in comments:
-            if 'id' not in comment:
-                comment['id'] = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
-                comment_fixes += 1
+        if any('id' not in comment for comment in comments):
+            for comment in comments:
+                if 'id' not in comment:
+                    comment['id'] = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+                    comment_fixes += 1
+            fields['comments'] = comments
+        return fields
     
-    save_posts(posts)
+    # Applied by the writer to the current posts, so concurrent comments and edits are kept
+    content_store.posts.update_each(clean_post)
     
     return {
         'success': True, 
@@ -1132,20 +1387,20 @@ def cleanup_posts():
     }
 
 
-@app.route('/edit/<int:index>', methods=['GET', 'POST'])
-def edit_post(index):
+@app.route('/edit/<post_id>', methods=['GET', 'POST'])
+def edit_post(post_id):
     if not session.get('logged_in'):
         return redirect(url_for('login'))
-    posts = load_posts()
-    if index < 0 or index >= len(posts):
+    post = content_store.posts.get(post_id)
+    if post is None:
         return redirect(url_for('forum'))
-    post = posts[index]
     if request.method == 'POST':
         if post.get('locked'):
             return redirect(url_for('forum'))
+        post = thaw(post)
         
         # Debug: Log form data
-        print(f"DEBUG: Editing post {index}")
+        print(f"DEBUG: Editing post {post_id}")
         print(f"DEBUG: Form keys: {list(request.form.keys())}")
         print(f"DEBUG: Title: '{request.form.get('title', '')}'")
         print(f"DEBUG: Content length: {len(request.form.get('content', ''))}")
@@ -1179,96 +1434,94 @@ def edit_post(index):
                 print("DEBUG: Cleared tags (empty input)")
         
         # Handle attachments and embedded images
-        attachments = save_uploaded_files(request.files.getlist('attachments'))
+        attachments = save_uploaded_files(request.files.getlist('attachments'), request.form.getlist('existing_attachments'))
         embedded = [f for f in request.form.get('embedded_images', '').split(',') if f]
-        post.setdefault('attachments', []).extend(attachments)
-        post.setdefault('embedded', []).extend(embedded)
+        # Uploads are named by content, so re-adding a file gives a name the post already lists
+        post['attachments'] = list(dict.fromkeys(post.get('attachments', []) + attachments))
+        post['embedded'] = list(dict.fromkeys(post.get('embedded', []) + embedded))
         
         print(f"DEBUG: Saving post with title: '{post['title']}', content length: {len(post['content'])}")
-        save_posts(posts)
+        fields = {k: post[k] for k in ('title', 'content', 'category', 'tags', 'attachments', 'embedded')}
+        if content_store.posts.apply('post_updated', id=post_id, fields=fields) is None:
+            # Deleted while it was being edited
+            abort(404)
         print("DEBUG: Posts saved successfully")
         return redirect(url_for('forum'))
     categories = load_categories()
-    return render_template('newpost.html', post=post, index=index, categories=categories)
+    return render_template('newpost.html', post=post, post_id=post_id, categories=categories)
 
 
-@app.route('/delete/<int:index>', methods=['POST'])
-def delete_post(index):
+@app.route('/delete/<post_id>', methods=['POST'])
+def delete_post(post_id):
     if not session.get('logged_in'):
         return redirect(url_for('login'))
-    posts = load_posts()
-    if index < 0 or index >= len(posts):
+    post = content_store.posts.get(post_id)
+    if post is None:
         return redirect(url_for('forum'))
-    if posts[index].get('locked'):
+    if post.get('locked'):
         return redirect(url_for('forum'))
-    posts.pop(index)
-    save_posts(posts)
+    content_store.posts.apply('post_deleted', id=post_id)
     return redirect(url_for('forum'))
 
 
-@app.route('/lock/<int:index>', methods=['POST'])
-def lock_post(index):
+@app.route('/lock/<post_id>', methods=['POST'])
+def lock_post(post_id):
     if not session.get('logged_in'):
         return redirect(url_for('login'))
-    posts = load_posts()
-    if index < 0 or index >= len(posts):
+    post = content_store.posts.get(post_id)
+    if post is None:
         return redirect(url_for('forum'))
-    posts[index]['locked'] = not posts[index].get('locked')
-    save_posts(posts)
+    if content_store.posts.apply('post_updated', id=post_id, fields={'locked': not post.get('locked')}) is None:
+        abort(404)
     return redirect(url_for('forum'))
 
 
-@app.route('/post/<int:index>', methods=['GET', 'POST'])
-def view_post(index):
-    posts = load_posts()
-    if index < 0 or index >= len(posts):
+@app.route('/post/<post_id>', methods=['GET', 'POST'])
+@conditional(post_validators, 'no-cache', per_session=True)
+def view_post(post_id):
+    post = content_store.posts.get(post_id)
+    if post is None:
         return redirect(url_for('forum'))
-    post = posts[index]
     if request.method == 'POST':
         name = request.form.get('name', 'Anonymous').strip() or 'Anonymous'
         text = request.form.get('comment', '').strip()
         if text:
             comment_id = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')  # Unique ID
-            post.setdefault('comments', []).append({
+            added = content_store.posts.apply('comment_added', id=post_id, comment={
                 'id': comment_id,
                 'name': name,
                 'text': text,
                 'created': datetime.utcnow().isoformat()
             })
-            save_posts(posts)
-            return redirect(url_for('view_post', index=index))
+            if added is None:
+                abort(404)
+            return redirect(url_for('view_post', post_id=post_id))
     comments = post.get('comments', [])
-    return render_template('post.html', post=post, index=index, comments=comments)
+    return render_template('post.html', post=post, post_id=post_id, comments=comments)
 
 
-@app.route('/delete-comment/<int:post_index>/<comment_id>', methods=['POST'])
-def delete_comment(post_index, comment_id):
+@app.route('/delete-comment/<post_id>/<comment_id>', methods=['POST'])
+def delete_comment(post_id, comment_id):
     if not session.get('logged_in'):
         return redirect(url_for('login'))
     
-    posts = load_posts()
-    if post_index < 0 or post_index >= len(posts):
+    if content_store.posts.get(post_id) is None:
         return redirect(url_for('forum'))
     
-    post = posts[post_index]
-    comments = post.get('comments', [])
-    
     # Remove comment with matching ID
-    post['comments'] = [c for c in comments if c.get('id') != comment_id]
-    save_posts(posts)
+    if content_store.posts.apply('comment_deleted', id=post_id, comment_id=comment_id) is None:
+        abort(404)
     
-    return redirect(url_for('view_post', index=post_index))
+    return redirect(url_for('view_post', post_id=post_id))
 
 
-@app.route('/post-annotations/<int:index>', methods=['GET', 'POST', 'DELETE'])
-def manage_post_annotations(index):
+@app.route('/post-annotations/<post_id>', methods=['GET', 'POST', 'DELETE'])
+def manage_post_annotations(post_id):
     """API endpoint for managing annotations on a specific post"""
-    posts = load_posts()
-    if index < 0 or index >= len(posts):
+    post = content_store.posts.get(post_id)
+    if post is None:
         return jsonify({'error': 'Post not found'}), 404
     
-    post = posts[index]
-    
     if request.method == 'GET':
         # Return current annotations
         return jsonify({
@@ -1292,8 +1545,8 @@ def manage_post_annotations(index):
                 'created': datetime.utcnow().isoformat()
             }
             
-            post.setdefault('annotations', []).append(new_annotation)
-            save_posts(posts)
+            if content_store.posts.apply('annotation_added', id=post_id, annotation=new_annotation) is None:
+                return jsonify({'error': 'Post not found'}), 404
             return jsonify({'success': True, 'annotation': new_annotation})
         
         else:
@@ -1308,9 +1561,9 @@ def manage_post_annotations(index):
         annotation_id = data.get('annotation_id', '')
         
         if annotation_id:
-            annotations = post.get('annotations', [])
-            post['annotations'] = [a for a in annotations if a.get('id') != annotation_id]
-            save_posts(posts)
+            post = content_store.posts.apply('annotation_deleted', id=post_id, annotation_id=annotation_id)
+            if post is None:
+                return jsonify({'error': 'Post not found'}), 404
             return jsonify({'success': True, 'annotations': post['annotations']})
         else:
             return jsonify({'error': 'Annotation ID not found'}), 404
@@ -1319,9 +1572,44 @@ def manage_post_annotations(index):
     return jsonify({'error': 'Invalid request method'}), 405
 
 
+# Posts used to be addressed by their position in posts.json. Those URLs still
+# work by redirecting to the post that currently sits at that position.
+LEGACY_POST_ROUTES = {
+    'view_post': '/post/<int:index>',
+    'edit_post': '/edit/<int:index>',
+    'delete_post': '/delete/<int:index>',
+    'lock_post': '/lock/<int:index>',
+    'manage_post_tags': '/post-tags/<int:index>',
+    'manage_post_annotations': '/post-annotations/<int:index>',
+    'debug_tags': '/debug-tags/<int:index>',
+    'delete_comment': '/delete-comment/<int:index>/<comment_id>',
+}
+
+
+def legacy_post_redirect(target, index, **values):
+    """Redirect a position-based post URL to its ID-based equivalent."""
+    post_id = content_store.posts.id_at(index)
+    if post_id is None:
+        if request.path.startswith(('/post-tags/', '/post-annotations/', '/debug-tags/')):
+            return jsonify({'error': 'Post not found'}), 404
+        return redirect(url_for('forum'))
+    # Query keys clashing with the route's own arguments (or url_for's _anchor, _external, ...) are dropped
+    query = {key: value for key, value in request.args.to_dict(flat=False).items()
+             if key not in values and key not in ('post_id', 'target') and not key.startswith('_')}
+    location = url_for(target, post_id=post_id, **values, **query)
+    # 307 keeps the method and body for forms and API calls
+    return redirect(location, code=302 if request.method == 'GET' else 307)
+
+
+for _target, _rule in LEGACY_POST_ROUTES.items():
+    app.add_url_rule(_rule, f'legacy_{_target}', legacy_post_redirect,
+                     defaults={'target': _target}, methods=['GET', 'POST', 'DELETE'])
+
+
 @app.route('/resources/<path:filename>')
 def resources(filename):
-    return send_from_directory(app.root_path, filename)
+    # Resource files can be replaced under the same name, so they are revalidated
+    return send_stored_file(app.root_path, filename, REVALIDATE)
 
 
 @app.route('/check-external-features')
@@ -1649,7 +1937,6 @@ def manage_external_tools():
     if not session.get('logged_in') or not session.get('secret_admin'):
         return redirect(url_for('login'))
     
-    config = load_external_tools_config()
     error = None
     success = None
     
@@ -1657,78 +1944,71 @@ def manage_external_tools():
         action = request.form.get('action', '')
         
         try:
-            if action == 'update_tool':
-                tool_id = request.form.get('tool_id', '')
-                enabled = bool(request.form.get('enabled'))
-                hidden = bool(request.form.get('hidden'))
-                
-                # Find and update server tool
-                for tool in config.get('server_tools', []):
-                    if tool.get('id') == tool_id:
-                        tool['enabled'] = enabled
-                        tool['hidden'] = hidden
-                        break
-                
-                if save_external_tools_config(config):
+            # The whole read-modify-write runs under the config file's lock
+            with external_tools_file.editing() as config:
+                if action == 'update_tool':
+                    tool_id = request.form.get('tool_id', '')
+                    enabled = bool(request.form.get('enabled'))
+                    hidden = bool(request.form.get('hidden'))
+                    
+                    # Find and update server tool
+                    for tool in config.get('server_tools', []):
+                        if tool.get('id') == tool_id:
+                            tool['enabled'] = enabled
+                            tool['hidden'] = hidden
+                            break
+                    
                     success = f"Tool {tool_id} updated successfully"
-                else:
-                    error = "Failed to save configuration"
                     
-            elif action == 'add_tool':
-                new_tool = {
-                    'id': request.form.get('new_tool_id', '').strip(),
-                    'name': request.form.get('new_tool_name', '').strip(),
-                    'description': request.form.get('new_tool_description', '').strip(),
-                    'icon': request.form.get('new_tool_icon', 'bi bi-gear').strip(),
-                    'type': request.form.get('new_tool_type', 'executable'),
-                    'executable': request.form.get('new_tool_executable', '').strip(),
-                    'website_url': request.form.get('new_tool_website_url', '').strip(),
-                    'enabled': bool(request.form.get('new_tool_enabled')),
-                    'hidden': bool(request.form.get('new_tool_hidden'))
-                }
-                
-                # Validate required fields based on type
-                if not all([new_tool['id'], new_tool['name']]):
-                    error = "Tool ID and name are required"
-                elif new_tool['type'] == 'website' and not new_tool['website_url']:
-                    error = "Website URL is required for website tools"
-                elif new_tool['type'] in ['executable', 'script'] and not new_tool['executable']:
-                    error = "Executable path is required for executable/script tools"
-                else:
-                    # Check for duplicate ID
-                    existing_ids = [tool.get('id') for tool in config.get('server_tools', [])]
-                    if new_tool['id'] in existing_ids:
-                        error = "Tool ID already exists"
+                elif action == 'add_tool':
+                    new_tool = {
+                        'id': request.form.get('new_tool_id', '').strip(),
+                        'name': request.form.get('new_tool_name', '').strip(),
+                        'description': request.form.get('new_tool_description', '').strip(),
+                        'icon': request.form.get('new_tool_icon', 'bi bi-gear').strip(),
+                        'type': request.form.get('new_tool_type', 'executable'),
+                        'executable': request.form.get('new_tool_executable', '').strip(),
+                        'website_url': request.form.get('new_tool_website_url', '').strip(),
+                        'enabled': bool(request.form.get('new_tool_enabled')),
+                        'hidden': bool(request.form.get('new_tool_hidden'))
+                    }
+                    
+                    # Validate required fields based on type
+                    if not all([new_tool['id'], new_tool['name']]):
+                        error = "Tool ID and name are required"
+                    elif new_tool['type'] == 'website' and not new_tool['website_url']:
+                        error = "Website URL is required for website tools"
+                    elif new_tool['type'] in ['executable', 'script'] and not new_tool['executable']:
+                        error = "Executable path is required for executable/script tools"
                     else:
-                        config.setdefault('server_tools', []).append(new_tool)
-                        if save_external_tools_config(config):
-                            success = f"Tool {new_tool['name']} added successfully"
+                        # Check for duplicate ID
+                        existing_ids = [tool.get('id') for tool in config.get('server_tools', [])]
+                        if new_tool['id'] in existing_ids:
+                            error = "Tool ID already exists"
                         else:
-                            error = "Failed to save configuration"
+                            config.setdefault('server_tools', []).append(new_tool)
+                            success = f"Tool {new_tool['name']} added successfully"
                             
-            elif action == 'delete_tool':
-                tool_id = request.form.get('tool_id', '')
-                config['server_tools'] = [tool for tool in config.get('server_tools', []) if tool.get('id') != tool_id]
-                
-                if save_external_tools_config(config):
+                elif action == 'delete_tool':
+                    tool_id = request.form.get('tool_id', '')
+                    config['server_tools'] = [tool for tool in config.get('server_tools', []) if tool.get('id') != tool_id]
+                    
                     success = f"Tool {tool_id} deleted successfully"
-                else:
-                    error = "Failed to save configuration"
                     
-            elif action == 'update_settings':
-                settings = config.setdefault('settings', {})
-                settings['allow_user_tools'] = bool(request.form.get('allow_user_tools'))
-                settings['max_user_tools'] = int(request.form.get('max_user_tools', 10))
-                settings['log_tool_usage'] = bool(request.form.get('log_tool_usage'))
-                
-                if save_external_tools_config(config):
+                elif action == 'update_settings':
+                    settings = config.setdefault('settings', {})
+                    settings['allow_user_tools'] = bool(request.form.get('allow_user_tools'))
+                    settings['max_user_tools'] = int(request.form.get('max_user_tools', 10))
+                    settings['log_tool_usage'] = bool(request.form.get('log_tool_usage'))
+                    
                     success = "Settings updated successfully"
-                else:
-                    error = "Failed to save settings"
                     
         except Exception as e:
+            success = None
             error = f"Error: {str(e)}"
     
+    config = load_external_tools_config()
+    
     return render_template('admin_external_tools.html', 
                          config=config, 
                          error=error, 
@@ -1767,50 +2047,218 @@ def client_tools(filename):
 
 
 
+def upload_cache_control(filename):
+    """Content-addressed uploads, and copies scaled from them, never change; others are revalidated."""
+    return IMMUTABLE if upload_digest(filename) else REVALIDATE
+
+
 @app.route('/uploads/<path:filename>')
 def uploads(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    """Serve an upload; images take ?w=<pixels> for the nearest downscaled copy at least that wide."""
+    if filename.split('/', 1)[0] in ('partial', GZIP_DIR):
+        # Unfinished chunked uploads and the gzipped copies of finished ones
+        abort(404)
+    width = request.args.get('w', type=int)
+    if not width:
+        # Only content-addressed uploads get gzipped copies: their bytes never change
+        return send_stored_file(UPLOAD_FOLDER, filename, upload_cache_control(filename),
+                                etag=upload_digest(filename) or True,
+                                gzip_dir=os.path.join(UPLOAD_FOLDER, GZIP_DIR) if upload_digest(filename) else None)
+    webp = 'image/webp' in request.headers.get('Accept', '')
+    path = derivative_path(UPLOAD_FOLDER, filename, width, webp)
+    if path is None:
+        # The copy may not be made yet, so don't let caches keep the original under this URL
+        response = send_stored_file(UPLOAD_FOLDER, filename, REVALIDATE)
+    else:
+        response = send_stored_file(os.path.dirname(path), os.path.basename(path), upload_cache_control(filename))
+    response.vary.add('Accept')
+    return response
 
 
-@app.route('/upload-image', methods=['POST'])
-def upload_image():
-    if not session.get('logged_in'):
-        return {'error': 'Not authenticated'}, 401
-    
-    file = request.files.get('image')
-    if not file:
-        return {'error': 'No file provided'}, 400
-    
+@app.route('/uploads/thumbs/<filename>')
+def upload_thumbnail(filename):
+    """Downscaled JPEG of an uploaded image for forum cards; the original if none can be made."""
+    path = thumbnail_path(UPLOAD_FOLDER, filename)
+    if path is None:
+        return send_stored_file(UPLOAD_FOLDER, filename, REVALIDATE)
+    return send_stored_file(os.path.dirname(path), os.path.basename(path), upload_cache_control(filename),
+                            mimetype='image/jpeg')
+
+
+def image_filename(filename, content_type):
+    """Return the filename of an editor image, with an extension from its content type if it has none."""
     # Handle cases where filename might be empty or None
-    original_filename = file.filename or 'pasted_image'
+    filename = filename or 'pasted_image'
     
     # For pasted images, we might not have a proper extension
-    if '.' not in original_filename:
-        # Try to detect content type and add appropriate extension
-        content_type = file.content_type or 'image/png'
+    if '.' not in filename:
+        content_type = content_type or 'image/png'
         if 'image/jpeg' in content_type or 'image/jpg' in content_type:
-            original_filename += '.jpg'
+            filename += '.jpg'
         elif 'image/gif' in content_type:
-            original_filename += '.gif'
+            filename += '.gif'
         elif 'image/webp' in content_type:
-            original_filename += '.webp'
+            filename += '.webp'
         else:
-            original_filename += '.png'  # default to png
-    
-    # Check if file type is allowed (expand for image types)
-    allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff', 'svg'}
-    if '.' in original_filename:
-        ext = original_filename.rsplit('.', 1)[1].lower()
-        if ext not in allowed_extensions:
+            filename += '.png'  # default to png
+    return filename
+
+
+@app.route('/upload-image/check', methods=['POST'])
+def check_upload():
+    """
+    Ask whether content with a given SHA-256 is already uploaded, before
+    sending it. JSON body: sha256, filename, content_type and kind ('image'
+    for editor images, 'attachment' for post attachments). If the bytes are
+    stored, the answer carries the same url and filename an upload would.
+    """
+    if not session.get('logged_in'):
+        return {'error': 'Not authenticated'}, 401
+    data = request.get_json(silent=True) or {}
+    digest = str(data.get('sha256', '')).lower()
+    kind = data.get('kind', 'image')
+    if kind == 'attachment':
+        filename = str(data.get('filename') or '')
+        if not allowed_file(filename):
+            return {'error': 'File type not allowed'}, 400
+        name = find_upload(UPLOAD_FOLDER, digest, filename)
+    elif kind == 'image':
+        filename = image_filename(str(data.get('filename') or ''), str(data.get('content_type') or ''))
+        ext = filename.rsplit('.', 1)[1].lower()
+        if ext not in IMAGE_EXTENSIONS:
             return {'error': f'File type {ext} not allowed'}, 400
+        name = find_upload(UPLOAD_FOLDER, digest, filename, keep_name=False)
+    else:
+        return {'error': 'kind must be image or attachment'}, 400
+    if name is None:
+        return {'exists': False}
+    return {
+        'exists': True,
+        'url': url_for('uploads', filename=name),
+        'filename': name,
+        'success': True
+    }
+
+
+def chunked_state(state):
+    return {'id': state['id'], 'received': state['received'], 'size': state['size'], 'chunk_size': chunked_uploads.chunk_size}
+
+
+@app.route('/upload-chunked', methods=['POST'])
+def start_chunked_upload():
+    """
+    Begin a resumable upload. JSON body: filename, size in bytes and kind
+    ('attachment' for a post attachment, 'resource' for a resource file).
+    The chunks then go to PUT /upload-chunked/<id>?offset=<bytes>.
+    """
+    if not session.get('logged_in'):
+        return {'error': 'Not authenticated'}, 401
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get('filename') or '')
+    kind = data.get('kind')
+    if kind == 'attachment' and not allowed_file(filename):
+        return {'error': 'File type not allowed'}, 400
+    if kind not in ('attachment', 'resource') or not secure_filename(filename):
+        return {'error': 'A filename and a kind of attachment or resource are required'}, 400
+    if kind == 'resource':
+        name = secure_filename(filename)
+        if not allowed_resource(name):
+            return {'error': resource_type_error()}, 400
+        # Checked again when the upload completes
+        if os.path.exists(os.path.join(app.root_path, name)):
+            return {'error': f'A file named {name} already exists'}, 409
+    size = data.get('size')
+    if not isinstance(size, int) or size <= 0:
+        return {'error': 'size must be a positive number of bytes'}, 400
+    try:
+        state = chunked_uploads.start(filename, size, kind)
+    except ValueError as e:
+        return {'error': str(e)}, 413
+    return chunked_state(state)
+
+
+@app.route('/upload-chunked/<upload_id>', methods=['GET', 'PUT'])
+def chunked_upload(upload_id):
+    """
+    GET reports how many bytes of an upload have arrived. PUT appends one
+    chunk: the raw bytes at ?offset=, with their SHA-256 in X-Chunk-SHA256.
+    A chunk for the wrong offset gets a 409 carrying the offset to resume from.
+    """
+    if not session.get('logged_in'):
+        return {'error': 'Not authenticated'}, 401
+    if request.method == 'GET':
+        state = chunked_uploads.status(upload_id)
+        if state is None:
+            return {'error': 'Unknown upload'}, 404
+        return chunked_state(state)
+    offset = request.args.get('offset', type=int)
+    if offset is None or request.content_length is None:
+        return {'error': 'offset and Content-Length are required'}, 400
+    try:
+        state = chunked_uploads.write_chunk(upload_id, offset, request.stream, request.content_length,
+                                            request.headers.get('X-Chunk-SHA256'))
+    except LookupError:
+        return {'error': 'Unknown upload'}, 404
+    except ChunkConflict as e:
+        return {'error': str(e), 'received': e.received}, 409
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    return chunked_state(state)
+
+
+@app.route('/upload-chunked/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """
+    Finish a resumable upload and move the file into place. Attachments
+    answer like /upload-image/check (url and filename, for
+    existing_attachments); resources answer with the filename for the
+    resource form's uploaded_file.
+    """
+    if not session.get('logged_in'):
+        return {'error': 'Not authenticated'}, 401
+    data = request.get_json(silent=True) or {}
+    try:
+        with chunked_uploads.finishing(upload_id, data.get('sha256')) as (state, path, digest):
+            if state['kind'] == 'attachment':
+                name = store_file(UPLOAD_FOLDER, path, digest, state['filename'])
+                placed = True
+            else:
+                name = secure_filename(state['filename'])
+                placed = place_resource(path, name)
+            # On a name clash the upload is kept, so it can still be finished later
+            if placed:
+                chunked_uploads.discard(upload_id)
+    except LookupError:
+        return {'error': 'Unknown upload'}, 404
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    if not placed:
+        return {'error': f'A file named {name} already exists'}, 409
+    if state['kind'] == 'attachment':
+        schedule_derivatives(UPLOAD_FOLDER, name)
+        return {'url': url_for('uploads', filename=name), 'filename': name, 'success': True}
+    session['chunked_resources'] = session.get('chunked_resources', [])[-9:] + [name]
+    return {'filename': name, 'success': True}
+
+
+@app.route('/upload-image', methods=['POST'])
+def upload_image():
+    if not session.get('logged_in'):
+        return {'error': 'Not authenticated'}, 401
+    
+    file = request.files.get('image')
+    if not file:
+        return {'error': 'No file provided'}, 400
     
-    # Generate unique filename
-    timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-    name = f"{timestamp}_{secure_filename(original_filename)}"
-    path = os.path.join(UPLOAD_FOLDER, name)
+    original_filename = image_filename(file.filename, file.content_type)
+    ext = original_filename.rsplit('.', 1)[1].lower()
+    if ext not in IMAGE_EXTENSIONS:
+        return {'error': f'File type {ext} not allowed'}, 400
     
     try:
-        file.save(path)
+        # Named by content, so pasting the same image again reuses the stored file
+        name = save_upload(UPLOAD_FOLDER, file.stream, original_filename, keep_name=False)
+        schedule_derivatives(UPLOAD_FOLDER, name)
         return {
             'url': url_for('uploads', filename=name), 
             'filename': name,
@@ -2046,6 +2494,7 @@ def manage_table_data(table_name):
 
 
 @app.route('/api/data-tables')
+@conditional(data_tables_validators, 'private, no-cache', per_session=True)
 def api_get_data_tables():
     """API endpoint to get list of custom data tables for other integrations."""
     if not session.get('logged_in'):
@@ -2078,6 +2527,7 @@ def api_get_data_tables():
 
 
 @app.route('/api/data-tables/<table_name>/data')
+@conditional(data_tables_validators, 'private, no-cache', per_session=True)
 def api_get_table_data(table_name):
     """API endpoint to get data from a specific custom table."""
     if not session.get('logged_in'):
@@ -2101,6 +2551,7 @@ def api_get_table_data(table_name):
 
 
 @app.route('/api/data-tables/<table_name>/related')
+@conditional(data_tables_validators, 'private, no-cache', per_session=True)
 def api_get_related_data(table_name):
     """Return a single row from a table matching a column value."""
     if not session.get('logged_in'):
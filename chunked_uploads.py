@@ -0,0 +1,165 @@
+"""
+Resumable uploads for large attachments and resource archives.
+The browser sends a file as a series of chunks, each with its SHA-256, and
+the server appends them straight to a partial file on disk. If the
+connection drops, the browser asks how much arrived and carries on from
+there. Nothing is buffered in memory or spooled to a second temp file; the
+finished file is moved into place.
+"""
+
+import hashlib
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from json_files import FileLock, write_json_atomic
+
+CHUNK_SIZE = 8 * 1024 * 1024
+READ_SIZE = 1 << 16
+# Partial uploads untouched for this long are deleted
+STALE_AFTER = 24 * 60 * 60
+
+
+class ChunkConflict(Exception):
+    """A chunk was sent for an offset other than the end of what has arrived."""
+
+    def __init__(self, received):
+        super().__init__(f'Expected a chunk at offset {received}')
+        self.received = received
+
+
+class ChunkedUploads:
+    """
+    Partial uploads kept in folder as <id>.part plus <id>.json (filename,
+    size, kind, received bytes). Each upload has its own lock file, so
+    several workers can take chunks without mixing them up.
+    """
+
+    def __init__(self, folder, max_size, chunk_size=CHUNK_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, upload_id, ext):
+        return os.path.join(self.folder, upload_id + ext)
+
+    def _read_state(self, upload_id):
+        try:
+            with open(self._path(upload_id, '.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def start(self, filename, size, kind):
+        """Begin an upload of size bytes and return its state, including the new id."""
+        if not isinstance(size, int) or size <= 0:
+            raise ValueError('size must be a positive number of bytes')
+        if size > self.max_size:
+            raise ValueError(f'File is larger than the {self.max_size // (1024 * 1024)} MB limit')
+        self.cleanup()
+        state = {'id': uuid.uuid4().hex, 'filename': filename, 'size': size, 'kind': kind, 'received': 0}
+        open(self._path(state['id'], '.part'), 'wb').close()
+        write_json_atomic(self._path(state['id'], '.json'), state)
+        return state
+
+    def status(self, upload_id):
+        """Return the state of an upload, or None if there is no such upload."""
+        if not upload_id.isalnum():
+            return None
+        return self._read_state(upload_id)
+
+    def write_chunk(self, upload_id, offset, stream, length, sha256):
+        """
+        Append length bytes read from stream at offset and return the new
+        state. Raises ChunkConflict for a chunk at the wrong offset and
+        ValueError for a bad chunk; nothing is kept from a rejected chunk.
+        """
+        if self.status(upload_id) is None:
+            raise LookupError(upload_id)
+        with FileLock(self._path(upload_id, '.lock')):
+            state = self._read_state(upload_id)
+            if state is None:
+                # Finished or discarded while this request waited for the lock
+                raise LookupError(upload_id)
+            if offset != state['received']:
+                raise ChunkConflict(state['received'])
+            if length <= 0 or length > self.chunk_size or offset + length > state['size']:
+                raise ValueError('Chunk size out of range')
+            digest = hashlib.sha256()
+            with open(self._path(upload_id, '.part'), 'r+b') as f:
+                f.seek(offset)
+                remaining = length
+                while remaining:
+                    data = stream.read(min(READ_SIZE, remaining))
+                    if not data:
+                        break
+                    digest.update(data)
+                    f.write(data)
+                    remaining -= len(data)
+                if remaining or digest.hexdigest() != (sha256 or '').lower():
+                    # Drop the partial chunk so the client can simply resend it
+                    f.truncate(offset)
+                    raise ValueError('Chunk incomplete or checksum mismatch')
+                f.flush()
+                os.fsync(f.fileno())
+            state['received'] = offset + length
+            write_json_atomic(self._path(upload_id, '.json'), state)
+            return state
+
+    @contextmanager
+    def finishing(self, upload_id, sha256=None):
+        """
+        Lock an upload, check that it is complete (and matches sha256 if
+        given) and yield (state, path of the assembled file, its SHA-256).
+        The caller moves the file away and calls discard() inside the block,
+        so a second request to finish the same upload finds it gone; the
+        lock file itself is removed after the lock is released.
+        """
+        if self.status(upload_id) is None:
+            raise LookupError(upload_id)
+        with FileLock(self._path(upload_id, '.lock')):
+            state = self._read_state(upload_id)
+            if state is None:
+                raise LookupError(upload_id)
+            if state['received'] != state['size']:
+                raise ValueError(f"Only {state['received']} of {state['size']} bytes received")
+            path = self._path(upload_id, '.part')
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for data in iter(lambda: f.read(READ_SIZE), b''):
+                    digest.update(data)
+            if sha256 and digest.hexdigest() != sha256.lower():
+                raise ValueError('File checksum mismatch')
+            yield state, path, digest.hexdigest()
+        # Not inside the block: Windows can't delete a file that is locked
+        if self._read_state(upload_id) is None:
+            self._remove_lock(upload_id)
+
+    def discard(self, upload_id):
+        """Delete an upload's data (but not its lock file, which may be held)."""
+        for ext in ('.part', '.json'):
+            try:
+                os.remove(self._path(upload_id, ext))
+            except OSError:
+                pass
+
+    def _remove_lock(self, upload_id):
+        try:
+            os.remove(self._path(upload_id, '.lock'))
+        except OSError:
+            pass
+
+    def cleanup(self):
+        """Delete partial uploads nobody has touched for STALE_AFTER seconds."""
+        cutoff = time.time() - STALE_AFTER
+        for entry in os.scandir(self.folder):
+            upload_id, ext = os.path.splitext(entry.name)
+            if ext == '.json' and entry.stat().st_mtime < cutoff:
+                self.discard(upload_id)
+                self._remove_lock(upload_id)
+            elif ext == '.lock' and entry.stat().st_mtime < cutoff and self._read_state(upload_id) is None:
+                # Recreated by a request that raced the end of the upload
+                self._remove_lock(upload_id)
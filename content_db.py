@@ -0,0 +1,508 @@
+"""
+SQLite storage for posts, categories and resources.
+The tables mirror the JSON content store: one row per post with its comments,
+annotations and tags in child tables, so reading or changing a post touches
+only that post's rows. Select it with TRUCKSOFT_CONTENT_BACKEND=sqlite after
+running ``python content_db.py`` once to import the existing JSON content.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+
+from content_store import (
+    POST_OPS, BodyCache, ContentStore, PostSnapshot, PostState, PostStore, Writer, manifest_entry,
+    new_post_id, normalize_post, normalize_posts, normalize_resources,
+)
+from json_files import FileLock, JsonDocument, file_signature, freeze, thaw
+from post_text import TEXT_SHADOW_VERSION, has_text_shadow
+
+CONTENT_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS content_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO content_meta (key, value) VALUES ('revision', 0);
+    -- post_text.TEXT_SHADOW_VERSION the stored posts were derived with
+    INSERT OR IGNORE INTO content_meta (key, value) VALUES ('text_shadow_version', 0);
+
+    -- extra holds every post field without a table of its own (attachments,
+    -- embedded, ...) as JSON; summary is manifest_entry() for listing pages
+    CREATE TABLE IF NOT EXISTS posts (
+        id TEXT PRIMARY KEY,
+        sort_key INTEGER NOT NULL,
+        revision INTEGER NOT NULL,
+        title TEXT NOT NULL DEFAULT '',
+        content TEXT NOT NULL DEFAULT '',
+        category TEXT NOT NULL DEFAULT 'General',
+        created TEXT NOT NULL DEFAULT '',
+        created_ts REAL NOT NULL DEFAULT 0,
+        author TEXT,
+        locked INTEGER NOT NULL DEFAULT 0,
+        extra TEXT NOT NULL DEFAULT '{}',
+        summary TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_posts_sort_key ON posts (sort_key);
+    CREATE INDEX IF NOT EXISTS idx_posts_revision ON posts (revision);
+    CREATE INDEX IF NOT EXISTS idx_posts_category ON posts (category, created_ts);
+    CREATE INDEX IF NOT EXISTS idx_posts_created ON posts (created_ts);
+    CREATE INDEX IF NOT EXISTS idx_posts_title ON posts (title COLLATE NOCASE);
+
+    CREATE TABLE IF NOT EXISTS comments (
+        post_id TEXT NOT NULL REFERENCES posts (id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        id TEXT,
+        created TEXT,
+        data TEXT NOT NULL,
+        PRIMARY KEY (post_id, position)
+    );
+    CREATE INDEX IF NOT EXISTS idx_comments_id ON comments (id);
+
+    CREATE TABLE IF NOT EXISTS annotations (
+        post_id TEXT NOT NULL REFERENCES posts (id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        id TEXT,
+        created TEXT,
+        data TEXT NOT NULL,
+        PRIMARY KEY (post_id, position)
+    );
+    CREATE INDEX IF NOT EXISTS idx_annotations_id ON annotations (id);
+
+    CREATE TABLE IF NOT EXISTS post_tags (
+        post_id TEXT NOT NULL REFERENCES posts (id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        tag TEXT NOT NULL,
+        PRIMARY KEY (post_id, position)
+    );
+    CREATE INDEX IF NOT EXISTS idx_post_tags_tag ON post_tags (tag, post_id);
+
+    -- Lets other workers drop deleted posts without rereading every row
+    CREATE TABLE IF NOT EXISTS deleted_posts (
+        id TEXT PRIMARY KEY,
+        revision INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_deleted_posts_revision ON deleted_posts (revision);
+
+    CREATE TABLE IF NOT EXISTS categories (
+        position INTEGER PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS resources (
+        position INTEGER PRIMARY KEY,
+        title TEXT NOT NULL DEFAULT '',
+        description TEXT NOT NULL DEFAULT '',
+        type TEXT NOT NULL DEFAULT 'download',
+        path TEXT NOT NULL DEFAULT '',
+        dynamic INTEGER NOT NULL DEFAULT 0,
+        category TEXT NOT NULL DEFAULT 'General',
+        extra TEXT NOT NULL DEFAULT '{}'
+    );
+    CREATE INDEX IF NOT EXISTS idx_resources_category ON resources (category);
+'''
+
+# Post fields stored in child tables rather than in posts.extra
+_CHILD_FIELDS = ('content', 'tags', 'comments', 'annotations')
+_RESOURCE_COLUMNS = ('title', 'description', 'type', 'path', 'dynamic', 'category')
+
+
+def connect(db_path):
+    """Open a connection in autocommit mode; callers manage transactions with BEGIN."""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA foreign_keys = ON')
+    return conn
+
+
+def init_content_schema(db_path):
+    """Create the content tables and indexes if they do not exist yet."""
+    with closing(connect(db_path)) as conn:
+        # WAL lets readers in other workers carry on while one worker writes
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.executescript(CONTENT_SCHEMA)
+
+
+def db_signature(db_path):
+    """Return a cheap change marker for a WAL-mode database: stat() of the file and its log."""
+    return (file_signature(db_path), file_signature(db_path + '-wal'))
+
+
+@contextmanager
+def write_transaction(conn):
+    """Run a block in a BEGIN IMMEDIATE transaction, which holds SQLite's write lock throughout."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _insert_children(conn, table, post_id, items):
+    conn.executemany(
+        f'INSERT INTO {table} (post_id, position, id, created, data) VALUES (?, ?, ?, ?, ?)',
+        [(post_id, position, item.get('id'), item.get('created'), json.dumps(item, ensure_ascii=False))
+         for position, item in enumerate(items)])
+
+
+def _delete_post_rows(conn, post_id):
+    for table in ('comments', 'annotations', 'post_tags'):
+        conn.execute(f'DELETE FROM {table} WHERE post_id = ?', (post_id,))
+    conn.execute('DELETE FROM posts WHERE id = ?', (post_id,))
+
+
+def write_post(conn, post, revision, sort_key=None):
+    """Insert or update one post's rows; without a sort_key the post goes to the top of the list."""
+    post = thaw(post)
+    summary = manifest_entry(post)
+    extra = {k: v for k, v in post.items() if k not in _CHILD_FIELDS}
+    if sort_key is None:
+        sort_key = conn.execute('SELECT COALESCE(MAX(sort_key), 0) + 1 FROM posts').fetchone()[0]
+    conn.execute('''
+        INSERT INTO posts (id, sort_key, revision, title, content, category, created, created_ts, author, locked, extra, summary)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            sort_key = excluded.sort_key, revision = excluded.revision, title = excluded.title, content = excluded.content,
+            category = excluded.category, created = excluded.created, created_ts = excluded.created_ts,
+            author = excluded.author, locked = excluded.locked, extra = excluded.extra, summary = excluded.summary
+    ''', (post['id'], sort_key, revision, post.get('title', ''), post.get('content', ''),
+          post.get('category', 'General'), post.get('created', ''), summary['created_ts'],
+          post.get('author'), int(bool(post.get('locked'))), json.dumps(extra, ensure_ascii=False),
+          json.dumps(summary, ensure_ascii=False)))
+    # Child rows are few per post, so they are simply rewritten
+    for table in ('comments', 'annotations', 'post_tags'):
+        conn.execute(f'DELETE FROM {table} WHERE post_id = ?', (post['id'],))
+    conn.executemany('INSERT INTO post_tags (post_id, position, tag) VALUES (?, ?, ?)',
+                     [(post['id'], position, tag) for position, tag in enumerate(post.get('tags', []))])
+    _insert_children(conn, 'comments', post['id'], post.get('comments', []))
+    _insert_children(conn, 'annotations', post['id'], post.get('annotations', []))
+
+
+def read_post(conn, post_id):
+    """Rebuild one post dict from its rows, or return None."""
+    row = conn.execute('SELECT content, extra FROM posts WHERE id = ?', (post_id,)).fetchone()
+    if row is None:
+        return None
+    post = json.loads(row['extra'])
+    post['content'] = row['content']
+    post['tags'] = [r['tag'] for r in conn.execute(
+        'SELECT tag FROM post_tags WHERE post_id = ? ORDER BY position', (post_id,))]
+    for table in ('comments', 'annotations'):
+        rows = conn.execute(f'SELECT data FROM {table} WHERE post_id = ? ORDER BY position', (post_id,)).fetchall()
+        if rows:
+            post[table] = [json.loads(r['data']) for r in rows]
+    return normalize_post(post)
+
+
+class SqlitePostStore(PostStore):
+    """
+    PostStore backed by the posts tables instead of shard files and a journal.
+
+    Snapshots, the writer thread and POST_OPS work exactly as in PostStore;
+    only persistence differs. Each mutation rewrites the affected post's
+    rows in one transaction and bumps content_meta.revision. Other workers
+    notice through a stat() of the database and its WAL, then fetch only the
+    posts whose revision is newer than the one they have (plus tombstones
+    from deleted_posts).
+    """
+
+    def __init__(self, store, db_path):
+        self.store = store
+        self.db_path = db_path
+        # Serialises this store's writers across workers, so the signature taken after a commit is ours
+        self.lock = FileLock(db_path + '.posts.lock')
+        self.version = 0
+        self._snapshot = None
+        self._writer = Writer('post-writer')
+        self._body_cache = BodyCache()
+        self._local = threading.local()
+        # Writer-thread state
+        self._dirty = set()
+        self._revision = 0
+        self._sort_keys = {}
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.db_path)
+        return conn
+
+    @contextmanager
+    def _reading(self):
+        # One read transaction, so a post's rows come from a single committed state
+        conn = self._db()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.execute('COMMIT')
+
+    def _signatures(self):
+        return db_signature(self.db_path)
+
+    def _read_shard(self, post_id):
+        with self._reading() as conn:
+            post = read_post(conn, post_id)
+        if post is None:
+            # Same signal as a vanished shard file; PostSnapshot.get() handles it
+            raise FileNotFoundError(post_id)
+        return freeze(post), 0
+
+    def _shard_seq(self, post_id, bodies):
+        # Rows are written in the same transaction as the change, so they are never ahead of it
+        return 0
+
+    def _load(self, signature):
+        with self._reading() as conn:
+            self._revision = conn.execute("SELECT value FROM content_meta WHERE key = 'revision'").fetchone()[0]
+            shadow_version = conn.execute("SELECT value FROM content_meta WHERE key = 'text_shadow_version'").fetchone()[0]
+            rows = conn.execute('SELECT id, sort_key, summary FROM posts ORDER BY sort_key DESC').fetchall()
+        self._sort_keys = {row['id']: row['sort_key'] for row in rows}
+        entries = {row['id']: freeze(json.loads(row['summary'])) for row in rows}
+        order = [row['id'] for row in rows]
+        self._dirty = set()
+        self._publish(PostState(self, entries, order), rebuild=True, signature=signature)
+        if shadow_version < TEXT_SHADOW_VERSION:
+            # Queued behind the current call, which may hold the lock
+            self._writer.submit(self._rederive_text_shadows)
+
+    def _rederive_text_shadows(self):
+        """Rewrite the posts whose stored text shadow predates TEXT_SHADOW_VERSION."""
+        try:
+            # Re-saving the content makes PostState.put derive the shadow again
+            count = self._update_each(lambda post: None if has_text_shadow(post) else {'content': post.get('content', '')})
+            with self.lock:
+                conn = self._db()
+                with write_transaction(conn):
+                    conn.execute("UPDATE content_meta SET value = ? WHERE key = 'text_shadow_version'", (TEXT_SHADOW_VERSION,))
+            print(f"Derived the text of {count} posts again")
+        except Exception as e:
+            print(f"Error deriving post text: {e}")
+
+    def _sync(self, conn, signature):
+        """Pick up posts other workers changed since our revision (inside a transaction)."""
+        current = self._snapshot
+        revision = conn.execute("SELECT value FROM content_meta WHERE key = 'revision'").fetchone()[0]
+        if revision == self._revision:
+            # The database changed for some other reason (users, categories...)
+            if signature != current.signature:
+                self._snapshot = PostSnapshot(self, current.entries, current.order, current.index, current.bodies, signature)
+            return
+        state = PostState(self, current.entries, current.order, current.bodies)
+        added = False
+        for row in conn.execute('SELECT id, sort_key FROM posts WHERE revision > ?', (self._revision,)).fetchall():
+            if row['id'] not in state.entries:
+                state.order.append(row['id'])
+                added = True
+            self._sort_keys[row['id']] = row['sort_key']
+            state.put(read_post(conn, row['id']))
+        for row in conn.execute('SELECT id FROM deleted_posts WHERE revision > ?', (self._revision,)).fetchall():
+            if row['id'] in state.entries:
+                state.changed[row['id']] = None
+                state.entries.pop(row['id'])
+                state.order.remove(row['id'])
+                self._sort_keys.pop(row['id'], None)
+        if added:
+            state.order.sort(key=lambda post_id: -self._sort_keys[post_id])
+        self._revision = revision
+        self._publish(state, signature=signature)
+
+    def _refresh(self):
+        """Writer thread: bring the snapshot up to date with the database."""
+        signature = self._signatures()
+        if self._snapshot is None:
+            self._load(signature)
+        elif signature != self._snapshot.signature:
+            with self._reading() as conn:
+                self._sync(conn, signature)
+        self._dirty = set()
+        return self._snapshot
+
+    def _apply(self, op_name, fields):
+        with self.lock:
+            conn = self._db()
+            with write_transaction(conn):
+                if self._snapshot is None:
+                    self._load(self._signatures())
+                self._sync(conn, self._signatures())
+                current = self._snapshot
+                state = PostState(self, current.entries, current.order, current.bodies)
+                revision = self._revision + 1
+                op = dict(fields, op=op_name, seq=revision)
+                if op_name == 'post_created':
+                    op['post'] = dict(op['post'], id=op['post'].get('id') or new_post_id())
+                    op['id'] = op['post']['id']
+                POST_OPS[op_name](state, op)
+                if not state.changed:
+                    return None
+                self._write_changes(conn, state, revision)
+            self._revision = revision
+            self._publish(state)
+            self._dirty = set()
+            return state.changed.get(op.get('id'))
+
+    def _update_each(self, change):
+        with self.lock:
+            conn = self._db()
+            with write_transaction(conn):
+                if self._snapshot is None:
+                    self._load(self._signatures())
+                self._sync(conn, self._signatures())
+                current = self._snapshot
+                state = PostState(self, current.entries, current.order, current.bodies)
+                revision = self._revision + 1
+                ops = self._collect_updates(state, change, revision)
+                if ops:
+                    self._write_changes(conn, state, revision)
+            if ops:
+                self._revision = revision
+                self._publish(state)
+            self._dirty = set()
+            return len(ops)
+
+    def _write_changes(self, conn, state, revision, sort_keys=None):
+        for post_id, post in state.changed.items():
+            if post is None:
+                _delete_post_rows(conn, post_id)
+                conn.execute('INSERT OR REPLACE INTO deleted_posts (id, revision) VALUES (?, ?)', (post_id, revision))
+                self._sort_keys.pop(post_id, None)
+            else:
+                sort_key = sort_keys[post_id] if sort_keys else self._sort_keys.get(post_id)
+                write_post(conn, post, revision, sort_key)
+                if sort_key is None:
+                    sort_key = conn.execute('SELECT sort_key FROM posts WHERE id = ?', (post_id,)).fetchone()[0]
+                self._sort_keys[post_id] = sort_key
+        conn.execute("UPDATE content_meta SET value = ? WHERE key = 'revision'", (revision,))
+
+    def _replace(self, posts):
+        with self.lock:
+            conn = self._db()
+            with write_transaction(conn):
+                current = self._refresh()
+                revision = self._revision + 1
+                state = PostState(self, {}, [])
+                for post in normalize_posts(thaw(posts)):
+                    post.setdefault('id', new_post_id())
+                    state.put(post, current.get(post['id']))
+                    state.order.append(post['id'])
+                for post_id in current.order:
+                    if post_id not in state.entries:
+                        state.changed[post_id] = None
+                # The list is newest first; keep that order
+                sort_keys = {post_id: len(state.order) - position for position, post_id in enumerate(state.order)}
+                self._write_changes(conn, state, revision, sort_keys)
+            self._revision = revision
+            self._publish(state, rebuild=True)
+            self._dirty = set()
+
+    def _compact(self):
+        # Fold the write-ahead log back into the database file
+        with closing(connect(self.db_path)) as conn:
+            conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+
+class SqliteList(JsonDocument):
+    """
+    A list-valued document (categories or resources) kept in one SQLite table.
+
+    It keeps JsonDocument's interface (snapshot, save, editing); saves
+    rewrite the table in one transaction, which suits these short admin lists.
+    """
+
+    def __init__(self, db_path, table, to_row, from_row, default, normalize=None, store=None):
+        super().__init__(db_path, default, normalize, store)
+        self.table = table
+        self.to_row = to_row
+        self.from_row = from_row
+        self.lock = FileLock(f'{db_path}.{table}.lock')
+
+    def _signature(self):
+        return db_signature(self.path)
+
+    def _read(self):
+        with closing(connect(self.path)) as conn:
+            rows = conn.execute(f'SELECT * FROM {self.table} ORDER BY position').fetchall()
+        data = [self.from_row(row) for row in rows] if rows else self.default()
+        if self.normalize:
+            data = self.normalize(data)
+        return freeze(data)
+
+    def _write(self, data):
+        rows = [self.to_row(position, item) for position, item in enumerate(thaw(data))]
+        with closing(connect(self.path)) as conn:
+            with write_transaction(conn):
+                conn.execute(f'DELETE FROM {self.table}')
+                if rows:
+                    placeholders = ', '.join('?' * len(rows[0]))
+                    conn.executemany(f'INSERT INTO {self.table} VALUES ({placeholders})', rows)
+
+
+def _category_row(position, name):
+    return (position, name)
+
+
+def _category_from_row(row):
+    return row['name']
+
+
+def _resource_row(position, resource):
+    extra = {k: v for k, v in resource.items() if k not in _RESOURCE_COLUMNS}
+    return (position, resource.get('title', ''), resource.get('description', ''), resource.get('type', 'download'),
+            resource.get('path', ''), int(bool(resource.get('dynamic'))), resource.get('category', 'General'),
+            json.dumps(extra, ensure_ascii=False))
+
+
+def _resource_from_row(row):
+    resource = {column: row[column] for column in _RESOURCE_COLUMNS}
+    resource['dynamic'] = bool(resource['dynamic'])
+    resource.update(json.loads(row['extra']))
+    return resource
+
+
+class SqliteContentStore(ContentStore):
+    """ContentStore whose posts, categories and resources live in the SQLite content tables."""
+
+    def __init__(self, db_path):
+        self.lock = threading.RLock()
+        self.version = 0
+        init_content_schema(db_path)
+        self.posts = SqlitePostStore(self, db_path)
+        self.categories = SqliteList(db_path, 'categories', _category_row, _category_from_row,
+                                     lambda: ['General'], store=self)
+        self.resources = SqliteList(db_path, 'resources', _resource_row, _resource_from_row,
+                                    list, normalize_resources, store=self)
+
+
+def import_json_content(db_path, posts_dir, legacy_posts_path, categories_path, resources_path):
+    """
+    Copy the JSON content into the SQLite tables, replacing what is there.
+
+    Posts come from the posts/ directory, which is first created from the
+    legacy posts.json if it does not exist yet.
+    """
+    source = ContentStore(posts_dir, categories_path, resources_path, legacy_posts_path=legacy_posts_path)
+    target = SqliteContentStore(db_path)
+    posts = source.posts.all()
+    target.posts.replace(posts)
+    target.categories.save(thaw(source.categories.snapshot()))
+    target.resources.save(thaw(source.resources.snapshot()))
+    print(f"Imported {len(posts)} posts, {len(target.categories.snapshot())} categories "
+          f"and {len(target.resources.snapshot())} resources into {db_path}")
+    return len(posts)
+
+
+if __name__ == "__main__":
+    root = os.path.dirname(os.path.abspath(__file__))
+    import_json_content(
+        os.path.join(root, 'database.db'),
+        os.path.join(root, 'posts'),
+        os.path.join(root, 'posts.json'),
+        os.path.join(root, 'categories.json'),
+        os.path.join(root, 'resources.json'),
+    )
@@ -0,0 +1,295 @@
+"""
+Listing indexes for forum posts.
+Each post gets a small integer ordinal and every category and tag maps to a
+bitset (a Python int) of the ordinals carrying it, so category and multi-tag
+filters become bitwise ANDs instead of scans over every post. Posts are also
+kept presorted by creation time and by title, so a page of results is a walk
+over an existing order rather than a sort per request. Infinite scroll
+resumes an order from an opaque cursor naming the last post already shown.
+"""
+
+import base64
+import json
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+
+SORT_ORDERS = ('newest', 'oldest', 'title')
+
+
+def iter_bits(bits):
+    """Yield the positions of the set bits in bits, lowest first."""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def _sort_keys(entry):
+    return entry.get('created_ts', 0), entry.get('title', '').casefold()
+
+
+def encode_cursor(sort_by, key, post_id):
+    """Return an opaque URL-safe cursor for resuming sort_by after the post with this sort key."""
+    raw = json.dumps([sort_by, key, post_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (sort_by, key, post_id) from encode_cursor(); raises ValueError for anything else."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_by, key, post_id = json.loads(raw)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    # Besides the index orders, callers may define their own (such as search relevance)
+    key_type = str if sort_by == 'title' else (int, float)
+    if not isinstance(sort_by, str) or not isinstance(key, key_type) or isinstance(key, bool) or not isinstance(post_id, str):
+        raise ValueError('Invalid cursor')
+    return sort_by, key, post_id
+
+
+def _discard(order, item):
+    position = bisect_left(order, item)
+    if position < len(order) and order[position] == item:
+        del order[position]
+
+
+# Mutable tables of a PostIndex, copied on first write after copy()
+_TABLES = ('_ordinals', '_ids', '_category_bits', '_tag_bits', '_tag_counts', '_by_created', '_by_title', '_keys')
+
+
+class PostIndex:
+    """Category and tag bitsets and sort orders over post ordinals, updated one post at a time."""
+
+    def __init__(self, entries=()):
+        self._ordinals = {}
+        self._ids = []
+        self.all_bits = 0
+        self._category_bits = {}
+        self._tag_bits = {}
+        self._tag_counts = {}
+        # Sorted lists of (created_ts, ordinal) and (casefolded title, ordinal)
+        self._by_created = []
+        self._by_title = []
+        self._keys = {}
+        # Tables this index may change in place; the rest are shared with the index it was copied from
+        self._owned = set(_TABLES)
+        for entry in entries:
+            self.add(entry)
+
+    def copy(self):
+        """
+        Return a copy a writer can change while readers keep using this one.
+        The copy shares every table and copies one only the first time it
+        changes it, so editing a post's tags copies the small category and tag
+        tables but none of the per-post ones.
+        """
+        other = PostIndex.__new__(PostIndex)
+        other.__dict__.update(self.__dict__)
+        other._owned = set()
+        return other
+
+    def _own(self, name):
+        table = getattr(self, name)
+        if name not in self._owned:
+            table = table.copy()
+            setattr(self, name, table)
+            self._owned.add(name)
+        return table
+
+    def ordinal(self, post_id):
+        return self._ordinals.get(post_id)
+
+    def _set(self, table, key, bit, on):
+        bits = table.get(key, 0)
+        bits = bits | bit if on else bits & ~bit
+        if bits:
+            table[key] = bits
+        else:
+            table.pop(key, None)
+
+    def _index_fields(self, entry, bit, on):
+        self._set(self._own('_category_bits'), entry.get('category', 'General'), bit, on)
+        tags = set(entry.get('tags', ()))
+        if not tags:
+            return
+        tag_bits = self._own('_tag_bits')
+        tag_counts = self._own('_tag_counts')
+        for tag in tags:
+            self._set(tag_bits, tag, bit, on)
+            count = tag_counts.get(tag, 0) + (1 if on else -1)
+            if count:
+                tag_counts[tag] = count
+            else:
+                tag_counts.pop(tag, None)
+
+    def _sort(self, ordinal, keys):
+        old = self._keys.get(ordinal)
+        if old == keys:
+            return
+        sort_keys = self._own('_keys')
+        by_created = self._own('_by_created')
+        by_title = self._own('_by_title')
+        if old is not None:
+            del sort_keys[ordinal]
+            _discard(by_created, (old[0], ordinal))
+            _discard(by_title, (old[1], ordinal))
+        if keys is not None:
+            sort_keys[ordinal] = keys
+            insort(by_created, (keys[0], ordinal))
+            insort(by_title, (keys[1], ordinal))
+
+    def add(self, entry):
+        ordinal = len(self._ids)
+        self._own('_ids').append(entry['id'])
+        self._own('_ordinals')[entry['id']] = ordinal
+        bit = 1 << ordinal
+        self.all_bits |= bit
+        self._index_fields(entry, bit, True)
+        self._sort(ordinal, _sort_keys(entry))
+
+    def remove(self, entry):
+        if entry['id'] not in self._ordinals:
+            return
+        ordinal = self._own('_ordinals').pop(entry['id'])
+        # Ordinals are not reused; the slot just stays empty
+        self._own('_ids')[ordinal] = None
+        bit = 1 << ordinal
+        self.all_bits &= ~bit
+        self._index_fields(entry, bit, False)
+        self._sort(ordinal, None)
+
+    def update(self, old_entry, new_entry):
+        """Reflect one post's change; either side may be None for a create or delete."""
+        if old_entry is None:
+            self.add(new_entry)
+        elif new_entry is None:
+            self.remove(old_entry)
+        else:
+            ordinal = self._ordinals[old_entry['id']]
+            bit = 1 << ordinal
+            self._index_fields(old_entry, bit, False)
+            self._index_fields(new_entry, bit, True)
+            self._sort(ordinal, _sort_keys(new_entry))
+
+    def match(self, category=None, tags=()):
+        """Return the bitset of posts in category (None for any) carrying every tag."""
+        bits = self.all_bits
+        if category is not None:
+            bits &= self._category_bits.get(category, 0)
+        for tag in tags:
+            bits &= self._tag_bits.get(tag, 0)
+        return bits
+
+    def ids(self, bits):
+        """Return the post IDs in a bitset, in ordinal order."""
+        return [self._ids[ordinal] for ordinal in iter_bits(bits)]
+
+    def count(self, bits):
+        return bin(bits).count('1')
+
+    def _walk(self, sort_by):
+        if sort_by == 'title':
+            return self._by_title
+        if sort_by == 'oldest':
+            return self._by_created
+        return reversed(self._by_created)
+
+    def ordered_ids(self, sort_by, bits):
+        """Yield the post IDs in bits in the given sort order (newest, oldest or title)."""
+        everything = bits == self.all_bits
+        for _, ordinal in self._walk(sort_by):
+            if everything or bits >> ordinal & 1:
+                yield self._ids[ordinal]
+
+    def page_ids(self, sort_by, bits, start, count):
+        """Return count post IDs from bits in sort order, skipping the first start."""
+        if start < 0 or count <= 0:
+            return []
+        if bits == self.all_bits and sort_by in ('oldest', 'title'):
+            order = self._by_title if sort_by == 'title' else self._by_created
+            return [self._ids[ordinal] for _, ordinal in order[start:start + count]]
+        if bits == self.all_bits:
+            end = len(self._by_created) - start
+            return [self._ids[ordinal] for _, ordinal in reversed(self._by_created[max(end - count, 0):max(end, 0)])]
+        return list(islice(self.ordered_ids(sort_by, bits), start, start + count))
+
+    def sort_key(self, sort_by, post_id):
+        """Return the key post_id is sorted by in the given order, or None if it is not indexed."""
+        ordinal = self._ordinals.get(post_id)
+        if ordinal is None:
+            return None
+        keys = self._keys[ordinal]
+        return keys[1] if sort_by == 'title' else keys[0]
+
+    def ids_after(self, sort_by, bits, key=None, post_id=None):
+        """
+        Yield the post IDs in bits in sort order, starting after the post
+        that had (key, post_id) in it, or from the beginning when key is None.
+
+        The starting point is found by bisection, so a deep page costs the same
+        as the first. If that post has since been deleted or re-sorted, the
+        walk resumes after every post sharing its old key.
+        """
+        descending = sort_by not in ('oldest', 'title')
+        order = self._by_title if sort_by == 'title' else self._by_created
+        if key is None:
+            position = len(order) if descending else 0
+        else:
+            ordinal = self._ordinals.get(post_id)
+            if ordinal is None or self.sort_key(sort_by, post_id) != key:
+                ordinal = -1 if descending else float('inf')
+            if descending:
+                position = bisect_left(order, (key, ordinal))
+            else:
+                position = bisect_right(order, (key, ordinal))
+        positions = range(position - 1, -1, -1) if descending else range(position, len(order))
+        everything = bits == self.all_bits
+        for i in positions:
+            ordinal = order[i][1]
+            if everything or bits >> ordinal & 1:
+                yield self._ids[ordinal]
+
+    def cursor(self, sort_by, post_id):
+        """Return the cursor for resuming sort_by after post_id (see ids_after)."""
+        return encode_cursor(sort_by, self.sort_key(sort_by, post_id), post_id)
+
+    def contains(self, bits, post_id):
+        ordinal = self._ordinals.get(post_id)
+        return ordinal is not None and bool(bits >> ordinal & 1)
+
+    def bits_of(self, post_ids):
+        """Return the bitset of the given post IDs, ignoring any that are not indexed."""
+        bits = 0
+        for post_id in post_ids:
+            ordinal = self._ordinals.get(post_id)
+            if ordinal is not None:
+                bits |= 1 << ordinal
+        return bits
+
+    def facet_counts(self, category=None, tags=(), within=None):
+        """
+        Return post counts for every category and tag under the active filters.
+
+        Category counts apply the tag filters (and within, e.g. search hits)
+        but not the category filter, so they show where switching category
+        would lead; tag counts apply every filter. Each count is one AND and
+        popcount over the maintained bitsets.
+        """
+        base = self.match(tags=tags)
+        if within is not None:
+            base &= within
+        narrowed = base if category is None else base & self._category_bits.get(category, 0)
+        return {
+            'categories': {name: self.count(bits & base) for name, bits in self._category_bits.items()},
+            'tags': {tag: self.count(bits & narrowed) for tag, bits in self._tag_bits.items()},
+            'any_category': self.count(base),
+            'total': self.count(narrowed),
+        }
+
+    def category_count(self, category):
+        return self.count(self._category_bits.get(category, 0))
+
+    def tag_counts(self):
+        """Return {tag: number of posts} for every tag in use."""
+        return dict(self._tag_counts)
@@ -0,0 +1,752 @@
+"""
+In-memory content store for the Tech Guides website.
+This module keeps posts, categories and resources parsed in memory and only
+re-reads a JSON file when its modification time or size changes on disk.
+Posts are sharded one file per post and mutations are recorded in an
+append-only journal (see PostStore). All files are written under lock files,
+so several worker processes can serve the same content directory.
+"""
+
+import os
+import json
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from content_index import PostIndex
+from json_files import FileLock, JsonDocument, file_signature, freeze, thaw, write_json_atomic
+from post_text import content_summary, created_epoch, has_text_shadow, text_shadow
+from thumbnails import thumbnail_url
+
+
+def normalize_post(p):
+    p.setdefault('embedded', [])
+    p.setdefault('tags', [])  # Ensure tags field always exists
+    p.setdefault('category', 'General')
+    p.setdefault('created', '')
+    return p
+
+
+def normalize_posts(posts):
+    for p in posts:
+        normalize_post(p)
+    return posts
+
+
+def normalize_resources(resources):
+    # Ensure backwards compatibility - add category field if missing
+    for resource in resources:
+        resource.setdefault('category', 'General')
+    return resources
+
+
+def new_post_id():
+    """Return a fresh immutable post ID (never all digits, so it can't be mistaken for a legacy index)."""
+    while True:
+        post_id = uuid.uuid4().hex[:12]
+        if not post_id.isdigit():
+            return post_id
+
+
+def manifest_entry(post):
+    """
+    Return the summary record kept in the manifest for a post.
+
+    This is everything a listing page needs (forum cards, sorting and
+    filtering), so listings never load full post bodies.
+    """
+    attachments = post.get('attachments', [])
+    embedded = post.get('embedded', [])
+    summary = content_summary(post)
+    return freeze(dict(
+        summary,
+        thumbnail=thumbnail_url(summary['first_image']),
+        id=post['id'],
+        title=post.get('title', ''),
+        category=post.get('category', 'General'),
+        tags=post.get('tags', []),
+        created=post.get('created', ''),
+        created_ts=created_epoch(post.get('created', '')),
+        locked=bool(post.get('locked')),
+        author=post.get('author', ''),
+        comment_count=len(post.get('comments', [])),
+        # Attachments not already shown inline in the content
+        files=[a for a in attachments if a not in embedded],
+    ))
+
+
+class PostState:
+    """Mutable working copy of the posts used while applying journal entries."""
+
+    def __init__(self, store, entries, order, bodies=None):
+        self.store = store
+        self.entries = dict(entries)
+        self.order = list(order)
+        # Cache of full records matching entries, as loaded from the shards
+        self.bodies = {} if bodies is None else bodies
+        # Full records touched by the applied entries; None marks a deleted post
+        self.changed = {}
+
+    def resolve(self, op):
+        """Return the ID of the post op addresses, or None if it no longer exists."""
+        # Entries journaled before posts had IDs address them by list position
+        if 'id' in op:
+            post_id = op['id']
+        elif 0 <= op['index'] < len(self.order):
+            post_id = self.order[op['index']]
+        else:
+            return None
+        return post_id if post_id in self.entries else None
+
+    def record(self, post_id):
+        if post_id in self.changed:
+            return self.changed[post_id]
+        return self.store._body(post_id, self.bodies)
+
+    def put(self, post, previous=None):
+        # Derive the plain-text shadow whenever the content is new or changed
+        if not has_text_shadow(post) or (previous is not None and previous.get('content') != post.get('content')):
+            post.update(text_shadow(post.get('content', '')))
+        frozen = freeze(post)
+        self.changed[frozen['id']] = frozen
+        self.entries[frozen['id']] = manifest_entry(frozen)
+
+    def already_in_shard(self, post_id, op):
+        # After a crash mid-compaction a shard can be newer than the manifest
+        if post_id in self.changed or self.store._shard_seq(post_id, self.bodies) < op.get('seq', 0):
+            return False
+        self.entries[post_id] = manifest_entry(self.store._body(post_id, self.bodies))
+        return True
+
+    def edit(self, op, change):
+        post_id = self.resolve(op)
+        # A post deleted just before the edit reached the writer
+        if post_id is None or self.already_in_shard(post_id, op):
+            return
+        previous = self.record(post_id)
+        post = thaw(previous)
+        change(post)
+        self.put(post, previous)
+
+
+def _op_post_created(state, op):
+    post = normalize_post(thaw(op['post']))
+    post.setdefault('id', new_post_id())
+    if not state.already_in_shard(post['id'], op):
+        state.put(post)
+    if post['id'] not in state.order:
+        state.order.insert(0, post['id'])
+
+
+def _op_post_updated(state, op):
+    state.edit(op, lambda p: p.update(op['fields']))
+
+
+def _op_post_deleted(state, op):
+    post_id = state.resolve(op)
+    if post_id is None:
+        return
+    state.changed[post_id] = None
+    state.entries.pop(post_id, None)
+    state.order.remove(post_id)
+
+
+def _op_comment_added(state, op):
+    state.edit(op, lambda p: p.setdefault('comments', []).append(op['comment']))
+
+
+def _op_comment_deleted(state, op):
+    def change(p):
+        p['comments'] = [c for c in p.get('comments', []) if c.get('id') != op['comment_id']]
+    state.edit(op, change)
+
+
+def _op_tag_added(state, op):
+    state.edit(op, lambda p: p['tags'].append(op['tag']))
+
+
+def _op_tag_removed(state, op):
+    def change(p):
+        p['tags'] = [t for t in p['tags'] if t != op['tag']]
+    state.edit(op, change)
+
+
+def _op_annotation_added(state, op):
+    state.edit(op, lambda p: p.setdefault('annotations', []).append(op['annotation']))
+
+
+def _op_annotation_deleted(state, op):
+    def change(p):
+        p['annotations'] = [a for a in p.get('annotations', []) if a.get('id') != op['annotation_id']]
+    state.edit(op, change)
+
+
+def _op_category_renamed(state, op):
+    # The category lives in the manifest, so only the affected shards are loaded
+    for post_id, entry in list(state.entries.items()):
+        if entry.get('category') == op['old']:
+            state.edit(dict(op, id=post_id), lambda p: p.update(category=op['new']))
+
+
+# Journal entry type -> function applying it to a PostState
+POST_OPS = {
+    'post_created': _op_post_created,
+    'post_updated': _op_post_updated,
+    'post_deleted': _op_post_deleted,
+    'comment_added': _op_comment_added,
+    'comment_deleted': _op_comment_deleted,
+    'tag_added': _op_tag_added,
+    'tag_removed': _op_tag_removed,
+    'annotation_added': _op_annotation_added,
+    'annotation_deleted': _op_annotation_deleted,
+    'category_renamed': _op_category_renamed,
+}
+
+
+# Bump when manifest_entry or the derived post fields change; older manifests are
+# rebuilt from the shards, and shards missing the current text shadow are rewritten
+MANIFEST_FORMAT = 5
+
+
+def _read_journal_file(path, offset=0):
+    """Return the journal entries after byte offset and the offset just past them."""
+    if not os.path.exists(path):
+        return [], 0
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        raw = f.read()
+    complete = raw[:raw.rfind(b'\n') + 1]
+    if len(complete) != len(raw):
+        # Drop a partially written trailing entry left by a crash
+        print(f"Discarding {len(raw) - len(complete)} bytes of incomplete journal entry")
+        with open(path, 'r+b') as f:
+            f.truncate(offset + len(complete))
+    ops = [json.loads(line) for line in complete.decode('utf-8').splitlines() if line.strip()]
+    return ops, offset + len(complete)
+
+
+class Writer:
+    """
+    A single background thread that runs submitted functions one at a time, in order.
+
+    Every post mutation goes through it, so writers never interleave and
+    readers only ever see the snapshots it publishes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._queue = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # A forked worker inherits the object but not the thread, so check liveness
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._queue = queue.Queue()
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) and return a Future for its result."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn on the writer thread and wait for its result (or exception)."""
+        if threading.current_thread() is self._thread:
+            # Already on the writer (a mutation calling another); waiting would deadlock
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _run(self):
+        while True:
+            future, fn, args, kwargs = self._queue.get()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+# Full post records kept in memory, besides those changed since the last compaction
+BODY_CACHE_SIZE = 512
+
+
+class BodyCache:
+    """
+    A bounded LRU of full post records shared by all snapshots of a store.
+
+    Each record is kept with the manifest entry it was read for. A post gets
+    a new entry object whenever it changes, so a snapshot only ever receives
+    records matching its own entries.
+    """
+
+    def __init__(self, maxsize=BODY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, post_id, entry):
+        with self._lock:
+            cached = self._records.get(post_id)
+            if cached is None or cached[0] is not entry:
+                return None
+            self._records.move_to_end(post_id)
+            return cached[1]
+
+    def put(self, post_id, entry, body):
+        with self._lock:
+            self._records[post_id] = (entry, body)
+            self._records.move_to_end(post_id)
+            while len(self._records) > self.maxsize:
+                self._records.popitem(last=False)
+
+
+class Bodies:
+    """
+    The full records a snapshot reads: those changed since the last
+    compaction (pinned, as the shards don't have them yet) over the store's
+    shared BodyCache, which fills in from the shards on demand.
+    """
+
+    def __init__(self, cache, entries, pinned=None):
+        self.cache = cache
+        self.entries = entries
+        self.pinned = {} if pinned is None else pinned
+
+    def get(self, post_id):
+        if post_id in self.pinned:
+            return self.pinned[post_id]
+        entry = self.entries.get(post_id)
+        return None if entry is None else self.cache.get(post_id, entry)
+
+    def setdefault(self, post_id, body):
+        found = self.get(post_id)
+        if found is not None:
+            return found
+        if post_id in self.entries:
+            self.cache.put(post_id, self.entries[post_id], body)
+        return body
+
+
+class PostSnapshot:
+    """
+    One published version of the posts. Nothing in it changes after publication.
+
+    Readers grab the current snapshot with a single attribute read and can
+    use it for a whole request without locks; the writer publishes a new one
+    (sharing what it doesn't change) instead of touching this one. Full
+    records are read through bodies, whose cache is shared between
+    snapshots but keyed by each snapshot's own manifest entries.
+    """
+
+    def __init__(self, store, entries, order, index, bodies, signature):
+        self._store = store
+        self.entries = entries
+        self.order = order
+        self.listing = tuple(entries[post_id] for post_id in order)
+        self.index = index
+        self.bodies = bodies
+        self.signature = signature
+
+    def entry(self, post_id):
+        """Return the summary record of one post, or None."""
+        return self.entries.get(post_id)
+
+    def get(self, post_id):
+        """Return the full read-only post, or None if it is not in this snapshot."""
+        if post_id not in self.entries:
+            return None
+        try:
+            return self._store._body(post_id, self.bodies)
+        except FileNotFoundError:
+            # Another worker deleted the post and compacted after this snapshot was taken
+            return None
+
+
+class PostStore:
+    """
+    Posts stored as one shard file per post plus a small manifest and a journal.
+
+    posts/manifest.json lists every post in order as a summary record with only
+    the fields listing pages need (see manifest_entry); posts/<id>.json holds
+    the full record. Summaries are rebuilt whenever a post is written.
+    Shards are read lazily, so viewing one post never parses the others.
+
+    Each mutation is appended to posts/journal.jsonl as one JSON line with a
+    single fsync, so write cost tracks the size of the change. Once the
+    journal grows past journal_limit bytes the writer thread rewrites only
+    the shards that changed plus the manifest, each via a temp file renamed
+    into place, then empties the journal. Shards and the manifest record the
+    journal sequence number they include, so replay after a crash at any
+    point of compaction is idempotent.
+
+    All mutations, reloads and compactions run on one Writer thread, which
+    publishes an immutable PostSnapshot after each; readers never lock.
+    The writer holds posts/.lock while touching files, so several worker
+    processes can append to the same journal. A worker notices another
+    one's writes by stat()ing the manifest and journal; if only the journal
+    grew it replays just the new tail instead of reloading everything.
+    """
+
+    def __init__(self, store, directory, legacy_path=None, journal_limit=256 * 1024):
+        self.store = store
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.journal_path = os.path.join(directory, 'journal.jsonl')
+        self.legacy_path = legacy_path
+        self.journal_limit = journal_limit
+        self.lock = FileLock(os.path.join(directory, '.lock'))
+        self.version = 0
+        self._snapshot = None
+        self._writer = Writer('post-writer')
+        self._body_cache = BodyCache()
+        # Everything below is only touched on the writer thread
+        self._shard_seqs = {}
+        self._dirty = set()
+        self._seq = 0
+        self._snapshot_seq = 0
+        self._journal_offset = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _signatures(self):
+        return (file_signature(self.manifest_path), file_signature(self.journal_path))
+
+    def _shard_path(self, post_id):
+        return os.path.join(self.directory, f'{post_id}.json')
+
+    def _read_shard(self, post_id):
+        with open(self._shard_path(post_id), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return freeze(normalize_post(data['post'])), data.get('journal_seq', 0)
+
+    def _body(self, post_id, bodies):
+        body = bodies.get(post_id)
+        if body is None:
+            body = bodies.setdefault(post_id, self._read_shard(post_id)[0])
+        return body
+
+    def _shard_seq(self, post_id, bodies):
+        if post_id not in self._shard_seqs:
+            if not os.path.exists(self._shard_path(post_id)):
+                return 0
+            body, self._shard_seqs[post_id] = self._read_shard(post_id)
+            bodies.setdefault(post_id, body)
+        return self._shard_seqs[post_id]
+
+    def _publish(self, state, rebuild=False, signature=None):
+        """Build the next snapshot from state and make it the current one."""
+        old = self._snapshot
+        listing = [state.entries[post_id] for post_id in state.order]
+        if rebuild or old is None:
+            index = PostIndex(listing)
+        else:
+            # Copy-on-write: readers of the old snapshot keep the old index
+            index = old.index.copy()
+            for post_id in state.changed:
+                index.update(old.entries.get(post_id), state.entries.get(post_id))
+        # Records not yet written to the shards stay pinned until the next compaction
+        pinned = {}
+        if old is not None:
+            pinned = {post_id: body for post_id, body in old.bodies.pinned.items() if post_id in self._dirty}
+        for post_id, post in state.changed.items():
+            if post is None:
+                pinned.pop(post_id, None)
+            else:
+                pinned[post_id] = post
+                self._body_cache.put(post_id, state.entries[post_id], post)
+            self._dirty.add(post_id)
+        if signature is None:
+            signature = self._signatures()
+        bodies = Bodies(self._body_cache, state.entries, pinned)
+        self._snapshot = PostSnapshot(self, state.entries, tuple(state.order), index, bodies, signature)
+        self.version = self.store.bump_version()
+
+    def _load(self):
+        if not os.path.exists(self.manifest_path) and self.legacy_path and os.path.exists(self.legacy_path):
+            self._import_legacy()
+            return
+        entries, order, seq, outdated = {}, [], 0, False
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            seq = manifest.get('journal_seq', 0)
+            outdated = manifest.get('format', 1) < MANIFEST_FORMAT
+            for entry in manifest.get('posts', []):
+                entries[entry['id']] = freeze(entry)
+                order.append(entry['id'])
+        self._shard_seqs = {}
+        self._dirty = set()
+        self._snapshot_seq = seq
+        bodies = {}
+        state = PostState(self, entries, order, bodies)
+        if outdated:
+            for post_id in order:
+                body = self._body(post_id, bodies)
+                if has_text_shadow(body):
+                    state.entries[post_id] = manifest_entry(body)
+                else:
+                    # Shards from before the current text shadow get it and are rewritten below
+                    state.put(thaw(body))
+        ops, self._journal_offset = _read_journal_file(self.journal_path)
+        for op in ops:
+            if op['seq'] <= self._snapshot_seq:
+                continue
+            POST_OPS[op['op']](state, op)
+            seq = op['seq']
+        self._seq = seq
+        self._publish(state, rebuild=True)
+        if outdated:
+            print(f"Rebuilt manifest summaries for {len(order)} posts")
+            self._checkpoint()
+
+    def _import_legacy(self):
+        """Split an old single-file posts.json (and its journal) into shards."""
+        with open(self.legacy_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            posts, legacy_seq = data, 0
+        else:
+            posts, legacy_seq = data.get('posts', []), data.get('journal_seq', 0)
+        self._shard_seqs = {}
+        self._dirty = set()
+        state = PostState(self, {}, [])
+        for post in normalize_posts(posts):
+            post.setdefault('id', new_post_id())
+            state.put(post)
+            state.order.append(post['id'])
+        legacy_journal = self.legacy_path + '.journal'
+        for op in _read_journal_file(legacy_journal)[0]:
+            if op['seq'] > legacy_seq:
+                POST_OPS[op['op']](state, op)
+        self._seq = 0
+        self._publish(state, rebuild=True)
+        self._checkpoint()
+        if os.path.exists(legacy_journal):
+            os.remove(legacy_journal)
+        print(f"Imported {len(state.order)} posts from {self.legacy_path} into {self.directory}")
+
+    def _catch_up(self):
+        """Apply the entries other workers appended to the journal since we last read it."""
+        ops, self._journal_offset = _read_journal_file(self.journal_path, self._journal_offset)
+        current = self._snapshot
+        state = PostState(self, current.entries, current.order, current.bodies)
+        for op in ops:
+            if op['seq'] > self._seq:
+                POST_OPS[op['op']](state, op)
+                self._seq = op['seq']
+        self._publish(state)
+
+    def _refresh(self):
+        """Writer thread: bring the snapshot up to date with the files on disk."""
+        with self.lock:
+            current = self._snapshot
+            signatures = self._signatures()
+            if current is None:
+                self._load()
+            elif signatures != current.signature:
+                manifest, journal = signatures
+                if manifest == current.signature[0] and journal and journal[1] > self._journal_offset:
+                    self._catch_up()
+                else:
+                    self._load()
+            return self._snapshot
+
+    def snapshot(self):
+        """
+        Return the current read-only PostSnapshot.
+
+        This is the lock-free read path: one attribute read plus two stat()
+        calls to notice other workers' writes. Routes that look at several
+        posts should take one snapshot and use it throughout.
+        """
+        current = self._snapshot
+        if current is None or self._signatures() != current.signature:
+            current = self._writer.call(self._refresh)
+        return current
+
+    def entries(self):
+        """Return the read-only manifest entries for all posts, newest first."""
+        return self.snapshot().listing
+
+    def get(self, post_id):
+        """Return the full read-only post with the given ID, or None."""
+        current = self.snapshot()
+        post = current.get(post_id)
+        if post is None and post_id in current.entries:
+            # Its shard vanished under us; look again in a fresh snapshot
+            post = self._writer.call(self._refresh).get(post_id)
+        return post
+
+    def all(self):
+        """Return every full post in order; this reads every shard, so avoid it on hot paths."""
+        current = self.snapshot()
+        return tuple(current.get(post_id) for post_id in current.order)
+
+    def entry(self, post_id):
+        """Return the summary record of one post, or None."""
+        return self.snapshot().entry(post_id)
+
+    def index(self):
+        """Return the category/tag index over the current posts (see content_index.PostIndex)."""
+        return self.snapshot().index
+
+    def id_at(self, index):
+        """Return the ID of the post at a legacy list position, or None."""
+        order = self.snapshot().order
+        if 0 <= index < len(order):
+            return order[index]
+        return None
+
+    def apply(self, op_name, **fields):
+        """
+        Journal a mutation, apply it in memory and return the affected post.
+
+        Returns None once the post is deleted, and also when it no longer
+        existed, in which case nothing is journaled.
+        """
+        return self._writer.call(self._apply, op_name, fields)
+
+    def _apply(self, op_name, fields):
+        with self.lock:
+            current = self._refresh()
+            state = PostState(self, current.entries, current.order, current.bodies)
+            op = dict(fields, op=op_name, seq=self._seq + 1)
+            if op_name == 'post_created':
+                op['post'] = dict(op['post'], id=op['post'].get('id') or new_post_id())
+                op['id'] = op['post']['id']
+            POST_OPS[op_name](state, op)
+            if not state.changed:
+                # The post is gone; there is nothing to journal
+                return None
+            self._journal([op])
+            self._publish(state)
+            return state.changed.get(op.get('id'))
+
+    def update_each(self, change):
+        """
+        Call change(post) with a mutable copy of every current post and journal
+        a post_updated entry for each post it returns fields for (None or {}
+        leaves the post alone). Runs on the writer under the lock, so no
+        concurrent write is lost. Returns the number of posts updated.
+        """
+        return self._writer.call(self._update_each, change)
+
+    def _update_each(self, change):
+        with self.lock:
+            current = self._refresh()
+            state = PostState(self, current.entries, current.order, current.bodies)
+            ops = self._collect_updates(state, change, self._seq + 1)
+            if ops:
+                self._journal(ops)
+                self._publish(state)
+            return len(ops)
+
+    def _collect_updates(self, state, change, first_seq):
+        ops = []
+        for post_id in list(state.order):
+            fields = change(thaw(state.record(post_id)))
+            if fields:
+                op = {'id': post_id, 'fields': fields, 'op': 'post_updated', 'seq': first_seq + len(ops)}
+                POST_OPS['post_updated'](state, op)
+                ops.append(op)
+        return ops
+
+    def _journal(self, ops):
+        # One write and fsync for all the entries of a mutation
+        lines = ''.join(json.dumps(op, ensure_ascii=False) + '\n' for op in ops)
+        with open(self.journal_path, 'ab') as f:
+            f.write(lines.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            self._journal_offset = f.tell()
+        self._seq = ops[-1]['seq']
+        if self._journal_offset > self.journal_limit:
+            # Queued behind this write, so the caller does not wait for it
+            self._writer.submit(self._compact_quietly)
+
+    def replace(self, posts):
+        """Replace every post at once (bulk maintenance) by rewriting all shards."""
+        self._writer.call(self._replace, posts)
+
+    def _replace(self, posts):
+        with self.lock:
+            current = self._refresh()
+            state = PostState(self, {}, [])
+            for post in normalize_posts(thaw(posts)):
+                post.setdefault('id', new_post_id())
+                state.put(post, current.get(post['id']))
+                state.order.append(post['id'])
+            for post_id in current.order:
+                if post_id not in state.entries:
+                    state.changed[post_id] = None
+            self._publish(state, rebuild=True)
+            self._checkpoint()
+
+    def compact(self):
+        """Write changed shards and the manifest, then empty the journal."""
+        self._writer.call(self._compact)
+
+    def _compact(self):
+        with self.lock:
+            self._refresh()
+            if self._dirty or self._seq != self._snapshot_seq:
+                self._checkpoint()
+
+    def _compact_quietly(self):
+        try:
+            self._compact()
+        except Exception as e:
+            print(f"Error compacting post journal: {e}")
+
+    def _checkpoint(self):
+        current = self._snapshot
+        removed = []
+        for post_id in self._dirty:
+            if post_id in current.entries:
+                write_json_atomic(self._shard_path(post_id), {'journal_seq': self._seq, 'post': current.bodies.pinned[post_id]})
+                self._shard_seqs[post_id] = self._seq
+            else:
+                removed.append(post_id)
+        write_json_atomic(self.manifest_path, {'format': MANIFEST_FORMAT, 'journal_seq': self._seq, 'posts': current.listing})
+        with open(self.journal_path, 'wb'):
+            pass
+        # Shards of deleted posts go last so a crash never leaves the manifest pointing at nothing
+        for post_id in removed:
+            self._shard_seqs.pop(post_id, None)
+            if os.path.exists(self._shard_path(post_id)):
+                os.remove(self._shard_path(post_id))
+        self._dirty = set()
+        self._snapshot_seq = self._seq
+        self._journal_offset = 0
+        # Same content, but the files changed; republish so readers don't reload it
+        bodies = Bodies(self._body_cache, current.entries)
+        self._snapshot = PostSnapshot(self, current.entries, current.order, current.index, bodies, self._signatures())
+
+
+class ContentStore:
+    """Posts, categories and resources behind a monotonically increasing version."""
+
+    def __init__(self, posts_dir, categories_path, resources_path, legacy_posts_path=None):
+        self.lock = threading.RLock()
+        self.version = 0
+        self.posts = PostStore(self, posts_dir, legacy_posts_path)
+        self.categories = JsonDocument(categories_path, lambda: ['General'], store=self)
+        self.resources = JsonDocument(resources_path, list, normalize_resources, store=self)
+
+    def bump_version(self):
+        with self.lock:
+            self.version += 1
+            return self.version
+
+    def current_version(self):
+        """Return the store version after picking up any on-disk changes."""
+        self.posts.entries()
+        self.categories.snapshot()
+        self.resources.snapshot()
+        return self.version
@@ -0,0 +1,128 @@
+"""
+Sending uploaded and resource files.
+Responses support Range and If-Range, so an interrupted download of a large
+manual resumes where it stopped, and carry validators for 304s. The caller
+picks the Cache-Control: content-addressed uploads never change, so
+browsers may keep them for a year without asking again. Optionally the
+transfer is handed to a fronting web server (nginx X-Accel-Redirect or
+Apache/lighttpd X-Sendfile), so no Python worker is tied up streaming it.
+Text uploads that never change (SVGs, logs) get a gzipped copy in
+uploads/gz/, written in the background on first request and then sent to
+clients that accept gzip.
+"""
+
+import gzip
+import mimetypes
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from flask import current_app, send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+from http_cache import COMPRESS_LEVEL, COMPRESS_MIN_SIZE, accepts_gzip, is_compressible
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Names that may be overwritten are revalidated (a 304 when unchanged)
+REVALIDATE = 'no-cache'
+# Gzipped copies of content-addressed uploads, under the upload folder
+GZIP_DIR = 'gz'
+# Larger files are always sent as they are
+GZIP_COPY_MAX_SIZE = 64 * 1024 * 1024
+READ_SIZE = 1 << 16
+
+
+def _offloaded(path, mimetype):
+    # The front server does Range, If-Range and conditional requests for the file itself
+    mode = current_app.config.get('FILE_OFFLOAD')
+    response = current_app.response_class(mimetype=mimetype)
+    if mode == 'x-accel':
+        # FILE_OFFLOAD_ROOT and ACCEL_REDIRECT_PREFIX are set in app.py, next to FILE_OFFLOAD
+        relative = os.path.relpath(path, current_app.config.get('FILE_OFFLOAD_ROOT', current_app.root_path))
+        if relative.startswith(os.pardir):
+            return None
+        prefix = current_app.config.get('ACCEL_REDIRECT_PREFIX', '/protected-files/')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative.replace(os.sep, '/'))
+    elif mode == 'x-sendfile':
+        response.headers['X-Sendfile'] = path
+    else:
+        return None
+    return response
+
+
+_gzip_pool = ThreadPoolExecutor(1, thread_name_prefix='gzip-copies')
+_gzip_pending = set()
+_gzip_lock = threading.Lock()
+
+
+def _write_gzip_copy(path, target):
+    tmp_path = f'{target}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Streamed, so memory use does not grow with the file; no name or time in the header
+        with open(path, 'rb') as source, open(tmp_path, 'wb') as raw:
+            with gzip.GzipFile(filename='', mode='wb', compresslevel=COMPRESS_LEVEL, fileobj=raw, mtime=0) as f:
+                shutil.copyfileobj(source, f, READ_SIZE)
+        os.replace(tmp_path, target)
+    except OSError as e:
+        print(f"Error compressing {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    finally:
+        with _gzip_lock:
+            _gzip_pending.discard(target)
+
+
+def gzip_copy(path, gzip_dir):
+    """
+    Return the path of the gzipped copy of a file kept in gzip_dir, or None
+    if there is no up-to-date copy yet; one is then queued on a background
+    thread, so the request never waits for it.
+    """
+    target = os.path.join(gzip_dir, os.path.basename(path) + '.gz')
+    try:
+        if os.path.getmtime(target) >= os.path.getmtime(path):
+            return target
+    except OSError:
+        pass
+    with _gzip_lock:
+        if target not in _gzip_pending:
+            _gzip_pending.add(target)
+            _gzip_pool.submit(_write_gzip_copy, path, target)
+    return None
+
+
+def send_stored_file(directory, filename, cache_control=REVALIDATE, mimetype=None, etag=True, gzip_dir=None):
+    """
+    Send directory/filename (404 if it isn't a file inside directory) with
+    cache_control, offloading the transfer when FILE_OFFLOAD is configured.
+    etag may be a string to use instead of one derived from the file's stat.
+    gzip_dir, only for files whose name never gets new content, is where
+    gzipped copies of compressible files are kept for clients accepting gzip.
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    response = None
+    if current_app.config.get('FILE_OFFLOAD'):
+        # The front server decides on compression for files it sends
+        response = _offloaded(path, mimetype)
+    if response is None:
+        compressible = (gzip_dir is not None and is_compressible(mimetype)
+                        and COMPRESS_MIN_SIZE <= os.path.getsize(path) <= GZIP_COPY_MAX_SIZE)
+        gzip_path = gzip_copy(path, gzip_dir) if compressible and accepts_gzip() else None
+        if gzip_path:
+            gzip_etag = etag + '-gzip' if isinstance(etag, str) else etag
+            response = send_file(gzip_path, mimetype=mimetype, etag=gzip_etag, conditional=True)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_file(path, mimetype=mimetype, etag=etag, conditional=True)
+        if compressible:
+            response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = cache_control
+    return response
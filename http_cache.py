@@ -0,0 +1,203 @@
+"""
+HTTP caching helpers for the Tech Guides website.
+Rendered pages are kept in small in-memory LRU caches tied to the content
+version, so a write anywhere in the content store retires them at once.
+Views can also answer conditional requests (If-None-Match and
+If-Modified-Since) with 304s based on the versions of the data they read.
+Text responses are gzipped for clients that accept it; cached pages keep
+their compressed bytes, so each is compressed once per content version.
+"""
+
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+
+# Smaller responses are sent as they are; gzip saves little on them
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+
+class PageCache:
+    """
+    A bounded LRU cache of rendered pages for the current content version.
+
+    Entries are only valid for one version: the first lookup or store with
+    a newer version empties the cache, and stores for an older version (a
+    slow render that raced a write) are dropped.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _use_version(self, version):
+        # Called with the lock held; returns False for a version older than the cached one
+        if self._version is not None and version < self._version:
+            return False
+        if version != self._version:
+            self._pages.clear()
+            self._version = version
+        return True
+
+    def get(self, version, key):
+        """Return the page cached under key for this version, or None."""
+        with self._lock:
+            if not self._use_version(version) or key not in self._pages:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return self._pages[key]
+
+    def put(self, version, key, page):
+        with self._lock:
+            if not self._use_version(version):
+                return
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.maxsize:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._version = None
+
+
+class CachedPage:
+    """
+    A rendered page as kept in a PageCache: the encoded HTML plus its gzipped
+    form, compressed for the first client that accepts it and then reused.
+    """
+
+    __slots__ = ('body', '_gzipped')
+
+    def __init__(self, html):
+        self.body = html.encode('utf-8')
+        self._gzipped = None
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip_bytes(self.body)
+        return self._gzipped
+
+    def response(self):
+        response = current_app.response_class(self.body, mimetype='text/html')
+        # Picked up by compress_response instead of compressing the body again
+        response.gzipped = self.gzipped
+        return response
+
+
+def gzip_bytes(data):
+    # A fixed timestamp keeps the output identical for identical input
+    return gzip.compress(data, COMPRESS_LEVEL, mtime=0)
+
+
+def is_compressible(mimetype):
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def accepts_gzip():
+    return request.accept_encodings['gzip'] > 0
+
+
+def compress_response(response):
+    """
+    An after_request hook that gzips text responses of at least
+    COMPRESS_MIN_SIZE bytes for clients that accept it. Files (sent with
+    direct passthrough) and streams are left alone; file_serving keeps
+    precompressed copies of files instead.
+    """
+    if response.direct_passthrough or response.is_streamed or not is_compressible(response.mimetype):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or 'Content-Encoding' in response.headers or not accepts_gzip():
+        return response
+    precompressed = getattr(response, 'gzipped', None)
+    if precompressed is not None:
+        data = precompressed()
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        data = gzip_bytes(body)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = 'gzip'
+    # The gzipped bytes differ from the plain ones, so the tag may only match weakly
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def make_etag(*parts):
+    """Return a strong ETag for the representation determined by parts (data versions, variant)."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def _not_modified(etag, last_modified):
+    # If-None-Match wins when both are sent; it compares weakly, so gzipped responses match too
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified and request.if_modified_since:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def conditional(validators, cache_control, per_session=False):
+    """
+    Make a GET view answer conditional requests.
+
+    validators(**view_args) returns (etag_parts, modified), where etag_parts
+    identify the data the view reads and modified is its newest change as
+    epoch seconds (or 0 if unknown). It runs before the view, so a matching
+    If-None-Match or If-Modified-Since gets a 304 without any rendering.
+    Successful responses carry the ETag, Last-Modified and cache_control;
+    pages of logged-in users are additionally marked private.
+
+    Views rendering per session (per_session, with the session in their
+    etag_parts) vary on the cookie. Logging in or out changes no file, so
+    only anonymous requests use Last-Modified there; the others rely on
+    the ETag alone.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            parts, modified = validators(**kwargs)
+            etag = make_etag(request.endpoint, parts)
+            last_modified = None
+            # A change later in the same second would keep the same Last-Modified,
+            # so the time only becomes a validator once that second is over
+            if modified and int(modified) < int(time.time()) and not (per_session and session):
+                last_modified = datetime.fromtimestamp(int(modified), timezone.utc)
+            if _not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if per_session:
+                response.vary.add('Cookie')
+            if last_modified:
+                response.last_modified = last_modified
+            if not cache_control.startswith(('public', 'private')) and session.get('logged_in'):
+                response.headers['Cache-Control'] = 'private, ' + cache_control
+            else:
+                response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,244 @@
+"""
+Shared JSON file helpers for the Tech Guides website.
+Every JSON file the site writes is replaced atomically (temp file + rename)
+while holding an exclusive lock file, so several worker processes can share
+them without losing each other's updates or reading a half-written file.
+Readers never take the lock; they notice another worker's write through a
+cheap stat() signature and reload.
+"""
+
+import os
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FrozenDict(dict):
+    """A dict that refuses modification, used for shared read-only snapshots."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Content snapshots are read-only; use load_posts() for a mutable copy')
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+def freeze(value):
+    """Recursively convert dicts and lists into read-only equivalents."""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """Recursively convert a frozen snapshot back into plain dicts and lists."""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
+def file_signature(path):
+    """Return a cheap change marker for a file: (mtime_ns, size, inode), or None if missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    # The inode changes on every atomic replace, even within one mtime tick
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def newest_mtime(*signatures):
+    """Return the latest modification time (epoch seconds) in file_signature() results, nested or not."""
+    newest = 0
+    for signature in signatures:
+        if not signature:
+            continue
+        if len(signature) == 3 and all(isinstance(part, int) for part in signature):
+            newest = max(newest, signature[0] / 1e9)
+        else:
+            newest = max(newest, newest_mtime(*signature))
+    return newest
+
+
+def _lock_file(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            # LK_LOCK gives up after about ten seconds; keep waiting
+            continue
+
+
+def _unlock_file(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """
+    An exclusive lock held on a lock file, shared by threads and processes.
+
+    It is reentrant within a thread, so a helper that takes the lock can be
+    called from code that already holds it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                f = open(self.path, 'a+b')
+                try:
+                    _lock_file(f)
+                except BaseException:
+                    f.close()
+                    raise
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            self._file = f
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            _unlock_file(self._file)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def write_json_atomic(path, data):
+    """Write data as JSON to a temp file and rename it over path, so readers see old or new, never half."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    for attempt in range(10):
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError:
+            # Windows refuses to replace a file another process has open for reading
+            if attempt == 9:
+                raise
+            time.sleep(0.05)
+
+
+class JsonDocument:
+    """
+    A single JSON file cached in memory and reloaded only when it changes.
+
+    Writes go through save() or editing(), which hold path + '.lock' so that
+    read-modify-write cycles in different workers do not overwrite each other.
+    When store is given, every change bumps its shared version.
+    """
+
+    def __init__(self, path, default, normalize=None, store=None):
+        self.path = path
+        self.default = default
+        self.normalize = normalize
+        self.store = store
+        self.lock = FileLock(path + '.lock')
+        self.version = 0
+        # (file signature, frozen data), swapped as one value so readers never see a mismatched pair
+        self._current = None
+
+    def _bump(self):
+        self.version = self.store.bump_version() if self.store else self.version + 1
+
+    def _signature(self):
+        return file_signature(self.path)
+
+    def _write(self, data):
+        write_json_atomic(self.path, data)
+
+    def signature(self):
+        """Return the current change marker of the stored data, usable as a cache validator."""
+        return self._signature()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            data = self.default()
+        else:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        if self.normalize:
+            data = self.normalize(data)
+        return freeze(data)
+
+    def snapshot(self):
+        """Return the current read-only data, reloading it if the file changed."""
+        current = self._current
+        signature = self._signature()
+        if current is None or signature != current[0]:
+            # Files are only ever replaced whole, so this read needs no lock
+            data = self._read()
+            if current is None or data != current[1]:
+                self._bump()
+            current = self._current = (signature, data)
+        return current[1]
+
+    def save(self, data):
+        """Write data to disk and publish it as the new snapshot."""
+        with self.lock:
+            self._write(data)
+            if self.normalize:
+                data = self.normalize(thaw(data))
+            self._current = (self._signature(), freeze(data))
+            self._bump()
+
+    @contextmanager
+    def editing(self):
+        """
+        Yield a mutable copy of the latest data and save it on exit if it changed.
+
+        The lock is held throughout, so the edit is based on what is on disk
+        right now rather than on what this worker last saw.
+        """
+        with self.lock:
+            original = self.snapshot()
+            data = thaw(original)
+            yield data
+            if data != thaw(original):
+                self.save(data)
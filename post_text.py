@@ -0,0 +1,243 @@
+"""
+Plain-text helpers for post content.
+This module turns the stored post HTML into the text, excerpts and
+references that listing pages need, so templates never parse markup.
+The text is derived once when a post is written (see text_shadow) and
+stored with it, so read paths never parse or lowercase HTML.
+"""
+
+import re
+from datetime import datetime, timezone
+from html import escape
+from html.parser import HTMLParser
+
+EXCERPT_LENGTH = 131
+
+# Elements whose text is never shown to readers (Word pastes include large <style> blocks)
+_HIDDEN_TAGS = {'style', 'script', 'head', 'title', 'xml'}
+_BLOCK_TAGS = {'br', 'p', 'div', 'li', 'tr', 'td', 'th', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'table', 'ul', 'ol'}
+# Inline formatting kept in HTML excerpts; everything else is reduced to its text
+_EXCERPT_TAGS = {'b', 'strong', 'i', 'em', 'u', 's', 'code', 'sub', 'sup', 'a'}
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.hidden = 0
+        self.first_image = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _HIDDEN_TAGS:
+            self.hidden += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append(' ')
+        if tag == 'img' and self.first_image is None:
+            src = dict(attrs).get('src')
+            if src and not src.startswith('data:'):
+                self.first_image = src
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in _HIDDEN_TAGS:
+            self.hidden -= 1
+
+    def handle_endtag(self, tag):
+        if tag in _HIDDEN_TAGS and self.hidden:
+            self.hidden -= 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_data(self, data):
+        if not self.hidden:
+            self.parts.append(data)
+
+
+def _excerpt_href(href):
+    """Return href if it is a web link or a path on this site, else None."""
+    # Browsers drop tabs and newlines inside URLs and read a backslash as a slash
+    href = re.sub(r'[\t\n\r]', '', href or '').strip()
+    if href.lower().startswith(('http://', 'https://')):
+        return href
+    # A second slash would make it protocol-relative, i.e. a link to another host
+    if href.startswith('/') and not href.replace('\\', '/').startswith('//'):
+        return href
+    return None
+
+
+class _ExcerptBuilder(HTMLParser):
+    """Re-emits the first budget characters of a post's visible text with its inline formatting."""
+
+    def __init__(self, budget):
+        super().__init__(convert_charrefs=True)
+        self.budget = budget
+        self.out = []
+        self.open = []
+        self.hidden = 0
+        self.visible = 0
+        self.space = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _HIDDEN_TAGS:
+            self.hidden += 1
+        elif tag in _BLOCK_TAGS:
+            self.space = True
+        elif tag in _EXCERPT_TAGS and not self.hidden and self.visible < self.budget:
+            self._space_before_word()
+            if tag != 'a':
+                self.out.append(f'<{tag}>')
+            else:
+                href = _excerpt_href(dict(attrs).get('href'))
+                if href is None:
+                    return
+                self.out.append(f'<a href="{escape(href)}" rel="noopener">')
+            self.open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self.space = True
+
+    def handle_endtag(self, tag):
+        if tag in _HIDDEN_TAGS and self.hidden:
+            self.hidden -= 1
+        elif tag in _BLOCK_TAGS:
+            self.space = True
+        elif tag in self.open:
+            # Close anything left open inside it, so the output stays balanced
+            while self.open:
+                inner = self.open.pop()
+                self.out.append(f'</{inner}>')
+                if inner == tag:
+                    break
+
+    def handle_data(self, data):
+        if self.hidden:
+            return
+        # Same whitespace rules as html_to_text, so character counts line up with the text shadow
+        for piece in re.split(r'(\s+)', data):
+            if not piece:
+                continue
+            if piece.isspace():
+                self.space = True
+                continue
+            if self.space and self.visible >= self.budget:
+                return
+            self._space_before_word()
+            room = self.budget - self.visible
+            if room <= 0:
+                return
+            self.out.append(escape(piece[:room], quote=False))
+            self.visible += min(len(piece), room)
+
+    def _space_before_word(self):
+        if self.space and self.visible:
+            self.out.append(' ')
+            self.visible += 1
+        self.space = False
+
+    def html(self):
+        return ''.join(self.out + [f'</{tag}>' for tag in reversed(self.open)])
+
+
+def _extract(content):
+    parser = _TextExtractor()
+    parser.feed(content or '')
+    parser.close()
+    return parser
+
+
+def _collapse(parts):
+    return re.sub(r'\s+', ' ', ''.join(parts)).strip()
+
+
+def html_to_text(content):
+    """Return the visible text of post HTML with whitespace collapsed."""
+    return _collapse(_extract(content).parts)
+
+
+def first_image(content):
+    """Return the src of the first embedded image in post HTML, or None."""
+    return _extract(content).first_image
+
+
+def excerpt_html(content, text=None, length=EXCERPT_LENGTH):
+    """
+    Return a short, tag-balanced HTML excerpt of post content.
+
+    It covers the same words as make_excerpt() on the visible text, keeps
+    only inline formatting (bold, italics, code, http(s) links) and drops
+    images, styles and every attribute except link targets.
+    """
+    if text is None:
+        text = html_to_text(content)
+    excerpt, _ = make_excerpt(text, length)
+    shortened = excerpt != text
+    builder = _ExcerptBuilder(len(excerpt) - 3 if shortened else len(text))
+    builder.feed(content or '')
+    builder.close()
+    return builder.html() + ('...' if shortened else '')
+
+
+def make_excerpt(text, length=EXCERPT_LENGTH, leeway=5):
+    """Shorten text at a word boundary the way Jinja's truncate filter does.
+
+    Returns (excerpt, truncated) where truncated says whether text is longer
+    than length, i.e. whether a "Read more" link is worth showing.
+    """
+    if len(text) <= length + leeway:
+        return text, len(text) > length
+    cut = text[:length - 3].rsplit(' ', 1)[0]
+    return cut + '...', True
+
+
+def created_epoch(created):
+    """Parse a post's 'created' value (either stored format) into a UTC epoch, or 0."""
+    for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(created, fmt).replace(tzinfo=timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            continue
+    return 0
+
+
+# Fields text_shadow() adds to a post record
+TEXT_SHADOW_FIELDS = ('text', 'word_count', 'first_image', 'excerpt_html', 'shadow_version')
+
+# Bump when text_shadow() derives something differently; older records are derived again
+TEXT_SHADOW_VERSION = 2
+
+
+def text_shadow(content):
+    """Return the fields derived from a post's HTML and stored with it: text, word_count, first_image and excerpt_html (plus shadow_version)."""
+    parser = _extract(content)
+    text = _collapse(parser.parts)
+    return {
+        'text': text,
+        'word_count': len(text.split()),
+        'first_image': parser.first_image,
+        'excerpt_html': excerpt_html(content, text),
+        'shadow_version': TEXT_SHADOW_VERSION,
+    }
+
+
+def has_text_shadow(post):
+    return all(field in post for field in TEXT_SHADOW_FIELDS) and post['shadow_version'] == TEXT_SHADOW_VERSION
+
+
+def post_shadow(post):
+    """Return a post's stored text shadow, deriving it only for records written before it existed."""
+    if has_text_shadow(post):
+        return {field: post[field] for field in TEXT_SHADOW_FIELDS}
+    return text_shadow(post.get('content', ''))
+
+
+def content_summary(post):
+    """Return the excerpt fields a forum card shows for a post, from its text shadow."""
+    shadow = post_shadow(post)
+    excerpt, truncated = make_excerpt(shadow['text'])
+    return {
+        'excerpt': excerpt,
+        'excerpt_html': shadow['excerpt_html'],
+        'truncated': truncated,
+        'first_image': shadow['first_image'],
+    }
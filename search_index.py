@@ -0,0 +1,321 @@
+"""
+Full-text search over forum posts.
+Titles, bodies and comments are reduced to plain text once per post write
+and kept in an inverted index of word tokens, ranked with BM25, plus a
+trigram index, so substring and part-number queries ('1280' in 'XP1280i')
+are found without scanning every post or matching the stored HTML markup.
+Titles, tags and categories also go into a sorted array for prefix
+suggestions while the user types.
+"""
+
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from itertools import islice
+
+from markupsafe import Markup, escape
+
+from post_text import post_shadow
+
+# Title words count this many times towards a post's term frequencies
+TITLE_WEIGHT = 2
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Score weight of a term found only inside longer words, relative to a whole-word hit
+SUBSTRING_WEIGHT = 0.5
+PHRASE_BONUS = 1.5
+# Terms shorter than this only match at the start of a word
+SHORT_TERM = 3
+SNIPPET_LENGTH = 160
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Split text into casefolded word tokens."""
+    return _WORD_RE.findall(text.casefold())
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class _Document:
+    __slots__ = ('title', 'body', 'comments', 'folded', 'terms', 'length', 'trigrams', 'prefixes')
+
+    def __init__(self, post):
+        self.title = post.get('title', '')
+        self.body = post_shadow(post)['text']
+        self.comments = ' '.join(c.get('text', '') for c in post.get('comments', ()))
+        self.folded = '\n'.join((self.title, self.body, self.comments)).casefold()
+        title_terms = tokenize(self.title)
+        other_terms = tokenize(self.body) + tokenize(self.comments)
+        self.terms = Counter(other_terms)
+        for term in title_terms:
+            self.terms[term] += TITLE_WEIGHT
+        self.length = TITLE_WEIGHT * len(title_terms) + len(other_terms)
+        self.trigrams = trigrams(self.folded)
+        # Terms too short for trigrams match word starts instead
+        self.prefixes = {term[:n] for term in self.terms for n in range(1, SHORT_TERM)}
+
+
+class SearchIndex:
+    """
+    BM25 and trigram indexes over the posts of a content snapshot.
+
+    search() first syncs with the snapshot it is given: posts whose summary
+    record changed since the last sync (every write publishes a new one) are
+    re-indexed and deleted posts dropped, so a write costs one post's worth
+    of work. A query matches posts containing every one of its words, whole
+    or inside a longer word (words shorter than SHORT_TERM only at the start
+    of a word); whole-word, title and exact-phrase hits rank higher.
+    """
+
+    def __init__(self, cache_size=64):
+        self.cache_size = cache_size
+        self._docs = {}
+        self._entries = {}
+        self._trigram_ids = {}
+        self._prefix_ids = {}
+        self._total_length = 0
+        self._synced = None
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _add(self, post_id, doc):
+        self._docs[post_id] = doc
+        self._total_length += doc.length
+        for gram in doc.trigrams:
+            self._trigram_ids.setdefault(gram, set()).add(post_id)
+        for prefix in doc.prefixes:
+            self._prefix_ids.setdefault(prefix, set()).add(post_id)
+
+    def _remove(self, post_id):
+        doc = self._docs.pop(post_id, None)
+        self._entries.pop(post_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc.length
+        for gram in doc.trigrams:
+            ids = self._trigram_ids[gram]
+            ids.discard(post_id)
+            if not ids:
+                del self._trigram_ids[gram]
+        for prefix in doc.prefixes:
+            ids = self._prefix_ids[prefix]
+            ids.discard(post_id)
+            if not ids:
+                del self._prefix_ids[prefix]
+
+    def _sync(self, posts):
+        if posts is self._synced:
+            return
+        for post_id, entry in posts.entries.items():
+            if self._entries.get(post_id) is entry:
+                continue
+            post = posts.get(post_id)
+            if post is None:
+                continue
+            self._remove(post_id)
+            self._add(post_id, _Document(post))
+            self._entries[post_id] = entry
+        for post_id in [p for p in self._docs if p not in posts.entries]:
+            self._remove(post_id)
+        self._synced = posts
+        self._results.clear()
+
+    def _containing(self, term):
+        if len(term) < SHORT_TERM:
+            return set(self._prefix_ids.get(term, ()))
+        # Narrow down with the trigram index, then confirm the actual substring
+        sets = sorted((self._trigram_ids.get(gram, set()) for gram in trigrams(term)), key=len)
+        candidates = set.intersection(*sets)
+        return {post_id for post_id in candidates if term in self._docs[post_id].folded}
+
+    def _score(self, terms, phrase, matches, hits):
+        count = len(self._docs)
+        average_length = self._total_length / count if count else 1
+        scores = {}
+        for post_id in hits:
+            doc = self._docs[post_id]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc.length / (average_length or 1))
+            score = 0.0
+            for term in terms:
+                df = len(matches[term])
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                if len(term) < SHORT_TERM:
+                    inside = sum(n for word, n in doc.terms.items() if word != term and word.startswith(term))
+                else:
+                    inside = doc.folded.count(term)
+                tf = doc.terms.get(term, 0) + SUBSTRING_WEIGHT * inside
+                score += idf * tf * (BM25_K1 + 1) / (tf + norm)
+            if len(terms) > 1 and phrase in doc.folded:
+                score *= PHRASE_BONUS
+            scores[post_id] = score
+        return scores
+
+    def search(self, posts, query):
+        """Return {post_id: score} for the posts in the snapshot that match query."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return {}
+        with self._lock:
+            self._sync(posts)
+            if query in self._results:
+                self._results.move_to_end(query)
+                return self._results[query]
+            matches = {}
+            hits = None
+            # Rarest-looking (longest) words first, so the intersection shrinks quickly
+            for term in sorted(terms, key=len, reverse=True):
+                matches[term] = self._containing(term)
+                hits = matches[term] if hits is None else hits & matches[term]
+                if not hits:
+                    break
+            scores = self._score(terms, ' '.join(terms), matches, hits) if hits else {}
+            self._results[query] = scores
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+            return scores
+
+    def snippet(self, post_id, query, length=SNIPPET_LENGTH):
+        """
+        Return an escaped excerpt of a post's body (or comments) around the
+        first match of query, with matches wrapped in <mark>, or None if the
+        post only matched on its title.
+        """
+        terms = sorted(set(tokenize(query)), key=len, reverse=True)
+        doc = self._docs.get(post_id)
+        if not terms or doc is None:
+            return None
+        pattern = re.compile('|'.join((r'\b' if len(term) < SHORT_TERM else '') + re.escape(term) for term in terms),
+                             re.IGNORECASE)
+        for text in (doc.body, doc.comments):
+            found = pattern.search(text)
+            if found:
+                break
+        else:
+            return None
+        start = max(found.start() - length // 3, 0)
+        if start:
+            start = min(text.find(' ', start) + 1 or start, found.start())
+        end = min(start + length, len(text))
+        if end < len(text):
+            space = text.rfind(' ', found.end(), end)
+            if space > 0:
+                end = space
+        window = text[start:end]
+        pieces = ['...' if start else '']
+        last = 0
+        for match in pattern.finditer(window):
+            pieces.append(escape(window[last:match.start()]))
+            pieces.append(Markup('<mark>%s</mark>') % match.group(0))
+            last = match.end()
+        pieces.append(escape(window[last:]))
+        pieces.append('...' if end < len(text) else '')
+        return Markup('').join(pieces)
+
+
+def _word_keys(label):
+    # One key per word start, so '1280' finds 'Gizmo 1280 setup' as well as '1280 Indicator'
+    folded = label.casefold()
+    return [folded[match.start():] for match in _WORD_RE.finditer(folded)]
+
+
+class SuggestIndex:
+    """
+    Prefix lookups over post titles, tags and categories for search-as-you-type.
+
+    Titles sit in a sorted array keyed from each word start, so a lookup is a
+    bisection plus a short walk. Like SearchIndex it syncs with the snapshot it
+    is given, moving only the titles of posts whose summary record changed;
+    the much smaller tag and category arrays are rebuilt when anything changes.
+    """
+
+    def __init__(self, scan_limit=200):
+        self.scan_limit = scan_limit
+        # Sorted (key, title, post_id)
+        self._titles = []
+        self._entries = {}
+        # Sorted (key, kind, label, post count) for tags and categories
+        self._labels = []
+        self._synced = None
+        self._lock = threading.Lock()
+
+    def _title_items(self, entry):
+        title = entry.get('title', '')
+        return [(key, title, entry['id']) for key in _word_keys(title)]
+
+    def _sync(self, posts, categories):
+        if self._synced == (posts, categories):
+            return
+        if self._synced is None or self._synced[0] is not posts:
+            for post_id, entry in posts.entries.items():
+                old = self._entries.get(post_id)
+                if old is entry:
+                    continue
+                if old is not None and old.get('title') == entry.get('title'):
+                    self._entries[post_id] = entry
+                    continue
+                self._remove_title(post_id)
+                for item in self._title_items(entry):
+                    insort(self._titles, item)
+                self._entries[post_id] = entry
+            for post_id in [p for p in self._entries if p not in posts.entries]:
+                self._remove_title(post_id)
+        labels = []
+        for tag, count in posts.index.tag_counts().items():
+            labels.extend((key, 'tag', tag, count) for key in _word_keys(tag))
+        for category in categories:
+            count = posts.index.category_count(category)
+            labels.extend((key, 'category', category, count) for key in _word_keys(category))
+        self._labels = sorted(labels)
+        self._synced = (posts, categories)
+
+    def _remove_title(self, post_id):
+        entry = self._entries.pop(post_id, None)
+        if entry is None:
+            return
+        for item in self._title_items(entry):
+            position = bisect_left(self._titles, item)
+            if position < len(self._titles) and self._titles[position] == item:
+                del self._titles[position]
+
+    def _scan(self, array, prefix):
+        position = bisect_left(array, (prefix,))
+        for item in islice(array, position, position + self.scan_limit):
+            if not item[0].startswith(prefix):
+                break
+            yield item
+
+    def suggest(self, posts, categories, prefix, limit=8):
+        """
+        Return {'titles', 'tags', 'categories'} matching prefix at the start of
+        any word, each at most limit long. Labels that start with prefix come
+        first, then tags and categories by post count.
+        """
+        prefix = prefix.casefold().strip()
+        result = {'titles': [], 'tags': [], 'categories': []}
+        if not prefix:
+            return result
+        with self._lock:
+            self._sync(posts, categories)
+            titles = {}
+            for key, title, post_id in self._scan(self._titles, prefix):
+                whole = key == title.casefold()
+                if post_id not in titles or whole:
+                    titles[post_id] = (not whole, title.casefold(), title)
+            labels = {}
+            for key, kind, label, count in self._scan(self._labels, prefix):
+                whole = key == label.casefold()
+                if (kind, label) not in labels or whole:
+                    labels[kind, label] = (not whole, -count, label.casefold(), count)
+        for post_id, (_, _, title) in sorted(titles.items(), key=lambda item: item[1])[:limit]:
+            result['titles'].append({'id': post_id, 'title': title})
+        for (kind, label), rank in sorted(labels.items(), key=lambda item: item[1]):
+            group = result['tags' if kind == 'tag' else 'categories']
+            if len(group) < limit:
+                group.append({'tag' if kind == 'tag' else 'category': label, 'count': rank[3]})
+        return result
@@ -0,0 +1,234 @@
+"""
+Downscaled copies of uploaded images.
+Forum card thumbnails are made the first time they are requested and kept in
+uploads/thumbs/. Responsive derivatives (WebP and JPEG at a few widths, in
+uploads/sized/) are made on a background worker pool right after an upload,
+so /uploads/<name>?w=480 can send phones a fraction of a full-size
+screenshot. Uploads get unique names and are never edited in place, so each
+image is scaled once. Pillow is optional; without it the original images are
+served everywhere.
+"""
+
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # Optional dependency
+    Image = None
+
+THUMBNAIL_SIZE = (480, 360)
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_DIR = 'thumbs'
+DERIVATIVE_WIDTHS = (320, 480, 800, 1280)
+DERIVATIVE_QUALITY = 80
+DERIVATIVE_DIR = 'sized'
+DERIVATIVE_WORKERS = 2
+# Image widths remembered for srcset, so pages don't reopen every image
+IMAGE_WIDTH_CACHE_SIZE = 1024
+# Browsers pick from the widths in srcset; images never display wider than the largest
+DERIVATIVE_SIZES = f'(max-width: {DERIVATIVE_WIDTHS[-1]}px) 100vw, {DERIVATIVE_WIDTHS[-1]}px'
+# Formats Pillow can scale; SVGs and other files are always served as they are
+RASTER_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.tiff')
+
+
+def thumbnail_url(src):
+    """Return the thumbnail URL for an image src under /uploads/, or None for anything else."""
+    if not src or not src.startswith('/uploads/'):
+        return None
+    name = src[len('/uploads/'):].split('?', 1)[0].split('#', 1)[0]
+    if not name or '/' in name or not name.lower().endswith(RASTER_EXTENSIONS):
+        return None
+    return '/uploads/thumbs/' + name
+
+
+def _flatten(image):
+    # JPEG has no transparency; flatten onto white like the page background
+    if image.mode in ('RGB', 'L'):
+        return image
+    rgba = image.convert('RGBA')
+    flat = Image.new('RGB', rgba.size, 'white')
+    flat.paste(rgba, mask=rgba.getchannel('A'))
+    return flat
+
+
+def thumbnail_path(upload_folder, name):
+    """
+    Return the path of the JPEG thumbnail of an uploaded image, making it if
+    needed, or None if Pillow is missing or the image can't be scaled.
+    """
+    if Image is None or name != os.path.basename(name) or not name.lower().endswith(RASTER_EXTENSIONS):
+        return None
+    source = os.path.join(upload_folder, name)
+    target = os.path.join(upload_folder, THUMBNAIL_DIR, name + '.jpg')
+    try:
+        source_mtime = os.path.getmtime(source)
+    except OSError:
+        return None
+    if os.path.exists(target) and os.path.getmtime(target) >= source_mtime:
+        return target
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f'{target}.{uuid.uuid4().hex}.tmp'
+    try:
+        with Image.open(source) as image:
+            image.thumbnail(THUMBNAIL_SIZE)
+            _flatten(image).save(tmp_path, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+        # Renamed into place, so concurrent requests never serve half a file
+        os.replace(tmp_path, target)
+    except (OSError, ValueError) as e:
+        print(f"Error creating thumbnail for {name}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    return target
+
+
+def derivative_name(name, width, ext):
+    return f'{name}.{width}w.{ext}'
+
+
+def make_derivatives(upload_folder, name):
+    """
+    Write WebP and JPEG copies of an uploaded image at each width in
+    DERIVATIVE_WIDTHS narrower than the original. Runs in a pool worker;
+    returns the widths made.
+    """
+    source = os.path.join(upload_folder, name)
+    target_dir = os.path.join(upload_folder, DERIVATIVE_DIR)
+    made = []
+    try:
+        with Image.open(source) as image:
+            if getattr(image, 'is_animated', False):
+                # Scaling would keep only the first frame
+                return made
+            if image.mode not in ('RGB', 'RGBA', 'L'):
+                # Palette images would otherwise be scaled without filtering
+                image = image.convert('RGBA')
+            os.makedirs(target_dir, exist_ok=True)
+            for width in DERIVATIVE_WIDTHS:
+                if width >= image.width:
+                    break
+                height = max(1, round(image.height * width / image.width))
+                scaled = _flatten(image.resize((width, height), Image.LANCZOS))
+                for ext, image_format in (('webp', 'WEBP'), ('jpg', 'JPEG')):
+                    target = os.path.join(target_dir, derivative_name(name, width, ext))
+                    tmp_path = f'{target}.{uuid.uuid4().hex}.tmp'
+                    scaled.save(tmp_path, image_format, quality=DERIVATIVE_QUALITY)
+                    os.replace(tmp_path, target)
+                made.append(width)
+    except (OSError, ValueError) as e:
+        print(f"Error creating derivatives for {name}: {e}")
+    return made
+
+
+_pool = None
+# Images queued or being scaled right now
+_scheduled = set()
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    # Threads rather than processes: forking a threaded server can deadlock, and
+    # Pillow releases the GIL while it decodes, scales and encodes
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(DERIVATIVE_WORKERS, thread_name_prefix='derivatives')
+    return _pool
+
+
+def schedule_derivatives(upload_folder, name):
+    """Queue derivative generation for an uploaded image unless it is already queued. Returns immediately."""
+    if Image is None or not name.lower().endswith(RASTER_EXTENSIONS):
+        return
+    with _pool_lock:
+        if name in _scheduled:
+            return
+        _scheduled.add(name)
+        future = _get_pool().submit(make_derivatives, upload_folder, name)
+
+    def finished(future):
+        if future.exception() is not None:
+            print(f"Error creating derivatives for {name}: {future.exception()}")
+        with _pool_lock:
+            _scheduled.discard(name)
+    future.add_done_callback(finished)
+
+
+def derivative_path(upload_folder, name, width, webp):
+    """
+    Return the path of the smallest derivative at least width wide, or None
+    if the original is the nearest match or has no derivatives yet (they are
+    then queued, for images uploaded before derivatives existed).
+    """
+    if name != os.path.basename(name) or not name.lower().endswith(RASTER_EXTENSIONS):
+        return None
+    ext = 'webp' if webp else 'jpg'
+    for candidate in DERIVATIVE_WIDTHS:
+        if candidate < width:
+            continue
+        path = os.path.join(upload_folder, DERIVATIVE_DIR, derivative_name(name, candidate, ext))
+        if os.path.exists(path):
+            return path
+    # Only images that should have derivatives but lack even the smallest; the
+    # others would be queued again on every request
+    smallest = os.path.join(upload_folder, DERIVATIVE_DIR, derivative_name(name, DERIVATIVE_WIDTHS[0], ext))
+    if Image is not None and (image_width(upload_folder, name) or 0) > DERIVATIVE_WIDTHS[0] and not os.path.exists(smallest):
+        schedule_derivatives(upload_folder, name)
+    return None
+
+
+_widths = OrderedDict()
+_widths_lock = threading.Lock()
+
+
+def image_width(upload_folder, name):
+    """Return the pixel width of an uploaded image (read from its header once), or None."""
+    with _widths_lock:
+        if name in _widths:
+            _widths.move_to_end(name)
+            return _widths[name]
+    try:
+        with Image.open(os.path.join(upload_folder, name)) as image:
+            # Animated images get no derivatives, so nothing to offer
+            width = None if getattr(image, 'is_animated', False) else image.width
+    except (OSError, ValueError):
+        return None
+    with _widths_lock:
+        _widths[name] = width
+        while len(_widths) > IMAGE_WIDTH_CACHE_SIZE:
+            _widths.popitem(last=False)
+    return width
+
+
+def image_srcset(upload_folder, src):
+    """
+    Return a srcset value offering the derivatives of an image under
+    /uploads/ narrower than the original, plus the original, or ''.
+    """
+    if Image is None or thumbnail_url(src) is None:
+        return ''
+    width = image_width(upload_folder, src[len('/uploads/'):])
+    if not width or width <= DERIVATIVE_WIDTHS[0]:
+        return ''
+    candidates = [f'{src}?w={w} {w}w' for w in DERIVATIVE_WIDTHS if w < width]
+    return ', '.join(candidates + [f'{src} {width}w'])
+
+
+_UPLOAD_IMG_RE = re.compile(r'<img\b(?![^>]*\bsrcset=)([^>]*?\bsrc=")(/uploads/[^"?#]+)(")', re.IGNORECASE)
+
+
+def responsive_images(upload_folder, content):
+    """Add srcset and sizes to the uploaded images embedded in post HTML."""
+    if not content or Image is None:
+        return content
+
+    def add_srcset(match):
+        srcset = image_srcset(upload_folder, match.group(2))
+        if not srcset:
+            return match.group(0)
+        return f'{match.group(0)} srcset="{srcset}" sizes="{DERIVATIVE_SIZES}"'
+    return _UPLOAD_IMG_RE.sub(add_srcset, content)
@@ -0,0 +1,156 @@
+"""
+Content-addressed storage for files uploaded to the forum.
+Uploads are named after the SHA-256 of their bytes, so pasting the same
+screenshot again or re-saving a post reuses the file that is already there,
+and a name never changes meaning. Every distinct content is also linked
+into uploads/blobs/<sha256>; an attachment uploaded under a new name becomes
+another hard link to that blob rather than a second copy. Files from before
+this scheme keep their timestamped names; `python upload_store.py`
+hard-links any identical ones.
+"""
+
+import hashlib
+import os
+import re
+import sys
+import uuid
+
+from werkzeug.utils import secure_filename
+
+BLOB_DIR = 'blobs'
+# Hex digits of the digest kept in upload names (128 bits)
+NAME_DIGEST_LENGTH = 32
+CHUNK_SIZE = 1 << 16
+
+_CONTENT_NAME_RE = re.compile(r'^([0-9a-f]{%d})[._]' % NAME_DIGEST_LENGTH)
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def upload_digest(name):
+    """Return the digest prefix of a content-addressed upload name, or None for other names."""
+    match = _CONTENT_NAME_RE.match(name)
+    return match.group(1) if match else None
+
+
+def upload_label(name):
+    """Return the name to show for an upload: its original filename, without the digest."""
+    if upload_digest(name) and name[NAME_DIGEST_LENGTH] == '_':
+        return name[NAME_DIGEST_LENGTH + 1:]
+    return name
+
+
+def _blob_path(upload_folder, digest):
+    return os.path.join(upload_folder, BLOB_DIR, digest)
+
+
+def _link(source, target):
+    # Returns False where hard links are unsupported (some network and FAT drives)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except OSError:
+        return False
+    return True
+
+
+def upload_name(digest, filename, keep_name=True):
+    """Return the upload name for content with this SHA-256 (hex) uploaded as filename."""
+    filename = secure_filename(filename) or 'upload'
+    if keep_name:
+        return f'{digest[:NAME_DIGEST_LENGTH]}_{filename}'
+    return digest[:NAME_DIGEST_LENGTH] + os.path.splitext(filename)[1].lower()
+
+
+def find_upload(upload_folder, digest, filename, keep_name=True):
+    """
+    Return the upload name for content with this SHA-256 if the bytes are
+    already stored (linking the name to them if needed), else None.
+    """
+    if not _DIGEST_RE.match(digest):
+        return None
+    name = upload_name(digest, filename, keep_name)
+    if os.path.exists(os.path.join(upload_folder, name)):
+        return name
+    blob = _blob_path(upload_folder, digest)
+    if os.path.exists(blob) and _link(blob, os.path.join(upload_folder, name)):
+        return name
+    return None
+
+
+def store_file(upload_folder, path, digest, filename, keep_name=True):
+    """
+    Move the file at path, whose SHA-256 is digest, into the upload folder
+    and return its upload name. If the bytes are already stored the file is
+    dropped instead. path must be on the same drive as the upload folder.
+    """
+    name = find_upload(upload_folder, digest, filename, keep_name)
+    if name is not None:
+        os.remove(path)
+        return name
+    name = upload_name(digest, filename, keep_name)
+    os.replace(path, os.path.join(upload_folder, name))
+    _link(os.path.join(upload_folder, name), _blob_path(upload_folder, digest))
+    return name
+
+
+def save_upload(upload_folder, stream, filename, keep_name=True):
+    """
+    Store the bytes of stream and return their upload name: the digest
+    followed by _<filename> if keep_name, else just the digest and the
+    filename's extension. The bytes go to disk once, hashed on the way.
+    """
+    os.makedirs(os.path.join(upload_folder, BLOB_DIR), exist_ok=True)
+    tmp_path = os.path.join(upload_folder, f'.upload-{uuid.uuid4().hex}.tmp')
+    sha256 = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                f.write(chunk)
+        return store_file(upload_folder, tmp_path, sha256.hexdigest(), filename, keep_name)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def dedupe_uploads(upload_folder):
+    """
+    Replace identical files in the upload folder with hard links to one blob,
+    keeping every name. Returns the number of bytes freed.
+    """
+    os.makedirs(os.path.join(upload_folder, BLOB_DIR), exist_ok=True)
+    freed = 0
+    for entry in os.scandir(upload_folder):
+        if not entry.is_file() or entry.name.startswith('.'):
+            continue
+        blob = _blob_path(upload_folder, _file_digest(entry.path))
+        if not os.path.exists(blob):
+            _link(entry.path, blob)
+            continue
+        if os.path.samefile(blob, entry.path):
+            continue
+        size = entry.stat().st_size
+        link_path = entry.path + '.link'
+        if not _link(blob, link_path):
+            print("Hard links are not supported in the upload folder; nothing to do")
+            break
+        os.replace(link_path, entry.path)
+        freed += size
+    return freed
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+    print(f"Freed {dedupe_uploads(folder)} bytes in {folder}")